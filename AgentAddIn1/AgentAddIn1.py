@@ -10,10 +10,35 @@ import traceback
 import subprocess
 import json
 import uuid
+import re
 import os
 import sys
+import copy
+import time
+import types
+import queue
+import random
 import threading
+import collections
 from pathlib import Path
+from typing import Iterable
+
+# orjson is optional - fall back to stdlib json if it isn't bundled
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _dumpb = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _dumps = json.dumps
+    _loads = json.loads
+
+    def _dumpb(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
 
 # Add current directory to Python path for imports
 current_dir = Path(__file__).resolve().parent
@@ -38,8 +63,11 @@ except ImportError as e:
     CMD_NAME = 'PASCAL Agent'
     CMD_DESC = 'Chat, clarify, plan, and execute CAD steps safely.'
     PALETTE_ID = 'pascal_agent_palette'
+    AGENT_REPLY_EVENT_ID = 'pascal_agent_reply'
     PALETTE_WIDTH = 460
     PALETTE_HEIGHT = 600
+    PROFILE_SCAN_LIMIT = 5
+    MAX_PLAN_ACTIONS = 64
     
     # Paths
     HERE = current_dir
@@ -52,7 +80,9 @@ except ImportError as e:
     OPENAI_MODEL = "gpt-4o"
     MAX_RETRIES = 3
     RETRY_SLEEP_SECONDS = 0.5
+    MAX_RETRY_SLEEP_SECONDS = 30.0
     REQUEST_TIMEOUT = 180
+    MAX_OUTPUT_TOKENS = 1500
 
 # ============================================================
 # Global State Management
@@ -66,11 +96,56 @@ class AddinState:
         self.last_actions = []
         self.last_sketch = None
         self.last_profile = None
-        self.handlers = []
+        # Last message the user typed - confirm_execute only carries a fixed text
+        self.last_request = ""
+        # Event handlers registered once in run() - Fusion only holds weak references
+        self.handlers = ()
+        
+        # Long-lived agent worker process and its output pumps
+        self.agent_proc = None
+        self.agent_replies = None
+        self.agent_stderr = None
+        self.agent_reply_event = None
+        self.cmd_def = None
+        self.cmd_control = None
+        
+        # Last message sent to the palette, used to drop exact repeats
+        self.last_sent_html = None
+        
+        # Palette messages waiting for the next flush
+        self.pending_html = []
+        # Whether a flush_html event is already on its way
+        self.flush_pending = False
 
 # Global state instance
 _state = AddinState()
 
+# Fusion application handles, looked up once and reused
+_APP = None
+_UI = None
+_PALETTE = None
+
+def _app() -> adsk.core.Application:
+    """Get the cached Fusion application object"""
+    global _APP
+    if _APP is None:
+        _APP = adsk.core.Application.get()
+    return _APP
+
+def _ui() -> adsk.core.UserInterface:
+    """Get the cached Fusion user interface object"""
+    global _UI
+    if _UI is None:
+        _UI = _app().userInterface
+    return _UI
+
+def _clear_app_cache():
+    """Drop cached Fusion handles so a reload looks them up again"""
+    global _APP, _UI, _PALETTE
+    _APP = None
+    _UI = None
+    _PALETTE = None
+
 # ============================================================
 # Fusion UI Management
 # ============================================================
@@ -78,12 +153,29 @@ _state = AddinState()
 class FusionUI:
     """Handles Fusion 360 UI setup and management"""
     
+    # Where the command goes when the configured panel is missing, in order of preference
+    PANEL_CANDIDATES = (
+        ('FusionDesignEnvironment', 'SolidCreatePanel'),
+        ('FusionDesignEnvironment', 'SolidModifyPanel'),
+        ('FusionDesignEnvironment', 'SolidInspectPanel'),
+        ('FusionSolidEnvironment', 'SolidCreatePanel'),
+        ('FusionSolidEnvironment', 'SolidModifyPanel'),
+        ('FusionSolidEnvironment', 'SolidInspectPanel'),
+        ('FusionModelEnvironment', 'SolidCreatePanel'),
+        ('FusionModelEnvironment', 'SolidModifyPanel'),
+        ('FusionModelEnvironment', 'SolidInspectPanel')
+    )
+    
+    # Everywhere the command may have been added, for cleanup
+    CLEANUP_WORKSPACE_IDS = ('FusionDesignEnvironment', 'FusionSolidEnvironment', 'FusionModelEnvironment')
+    CLEANUP_PANEL_IDS = ('SolidCreatePanel', 'SolidModifyPanel', 'SolidInspectPanel', 'SolidAssemblePanel')
+    
     def __init__(self):
-        self.app = adsk.core.Application.get()
-        self.ui = self.app.userInterface
+        self.app = _app()
+        self.ui = _ui()
     
     def setup_command(self):
-        """Set up the main command button"""
+        """Set up the main command button - the only place commandCreated is hooked up"""
         try:
             # Check if command already exists
             cmd_def = self.ui.commandDefinitions.itemById(CMD_ID)
@@ -95,96 +187,96 @@ class FusionUI:
             # Add command created handler
             on_created = CommandCreatedHandler()
             cmd_def.commandCreated.add(on_created)
-            _state.handlers.append(on_created)
-            
-            # Try to add to panel with fallback options
-            panel_added = False
-            fallback_panels = [
-                'SolidCreatePanel',
-                'SolidModifyPanel', 
-                'SolidInspectPanel',
-                'SolidAssemblePanel'
-            ]
-            
-            for panel_id in fallback_panels:
-                try:
-                    ws = self.ui.workspaces.itemById(WORKSPACE_ID)
-                    if ws:
-                        panel = ws.toolbarPanels.itemById(panel_id)
-                        if panel and not panel.controls.itemById(CMD_ID):
-                            panel.controls.addCommand(cmd_def)
-                            panel_added = True
-                            if DEBUG:
-                                self.ui.messageBox(f"Command added to panel: {panel_id}", "Debug Info")
-                            break
-                except Exception as e:
-                    if DEBUG:
-                        self.ui.messageBox(f"Error trying panel {panel_id}: {e}", "Debug Info")
-                    continue
+            _state.handlers += (on_created,)
+            _state.cmd_def = cmd_def
+            
+            # Configured panel first, then the first candidate that exists
+            panel = None
+            workspaces = {}
+            for ws_id, panel_id in ((WORKSPACE_ID, PANEL_ID),) + self.PANEL_CANDIDATES:
+                if ws_id not in workspaces:
+                    workspaces[ws_id] = self.ui.workspaces.itemById(ws_id)
+                ws = workspaces[ws_id]
+                if ws:
+                    panel = ws.toolbarPanels.itemById(panel_id)
+                    if panel:
+                        break
             
-            if not panel_added:
-                if DEBUG:
-                    self.ui.messageBox("Could not add command to any panel. Command created but not visible.", "Debug Info")
+            if panel:
+                controls = panel.controls
+                _state.cmd_control = controls.itemById(CMD_ID) or controls.addCommand(cmd_def)
+                _dbg(f"Command added to panel: {panel.id}", "Debug Info")
+            else:
+                _dbg("Could not add command to any panel. Command created but not visible.", "Debug Info")
                     
         except Exception as e:
-            if DEBUG:
-                self.ui.messageBox(f"Error in setup_command: {e}", "Debug Info")
+            _dbg(f"Error in setup_command: {e}", "Debug Info")
             raise
     
+    def _remove_controls_by_scan(self):
+        """Remove the command from every known workspace panel"""
+        for ws_id in self.CLEANUP_WORKSPACE_IDS:
+            try:
+                ws = self.ui.workspaces.itemById(ws_id)
+                if not ws:
+                    continue
+                toolbar_panels = ws.toolbarPanels
+                for panel_id in self.CLEANUP_PANEL_IDS:
+                    try:
+                        panel = toolbar_panels.itemById(panel_id)
+                        if panel:
+                            ctrl = panel.controls.itemById(CMD_ID)
+                            if ctrl:
+                                ctrl.deleteMe()
+                                _dbg(f"Removed command from {panel_id}", "Debug Info")
+                    except Exception as e:
+                        _dbg(f"Error removing from panel {panel_id}: {e}", "Debug Info")
+            except Exception as e:
+                _dbg(f"Error accessing workspace {ws_id}: {e}", "Debug Info")
+    
     def cleanup_command(self):
         """Clean up command and UI elements"""
+        global _PALETTE
+        
         try:
-            # Remove from panel - try multiple workspaces and panels
-            workspaces_to_try = ['FusionDesignEnvironment', 'FusionSolidEnvironment', 'FusionModelEnvironment']
-            panels_to_try = ['SolidCreatePanel', 'SolidModifyPanel', 'SolidInspectPanel', 'SolidAssemblePanel']
-            
-            for ws_id in workspaces_to_try:
+            # Remove from panel - directly when we know where it was added
+            removed = False
+            ctrl, _state.cmd_control = _state.cmd_control, None
+            if ctrl:
                 try:
-                    ws = self.ui.workspaces.itemById(ws_id)
-                    if ws:
-                        for panel_id in panels_to_try:
-                            try:
-                                panel = ws.toolbarPanels.itemById(panel_id)
-                                if panel:
-                                    ctrl = panel.controls.itemById(CMD_ID)
-                                    if ctrl:
-                                        ctrl.deleteMe()
-                                        if DEBUG:
-                                            self.ui.messageBox(f"Removed command from {panel_id}", "Debug Info")
-                            except Exception as e:
-                                if DEBUG:
-                                    self.ui.messageBox(f"Error removing from panel {panel_id}: {e}", "Debug Info")
-                                continue
+                    if ctrl.isValid:
+                        ctrl.deleteMe()
+                        removed = True
+                        _dbg("Removed command control", "Debug Info")
                 except Exception as e:
-                    if DEBUG:
-                        self.ui.messageBox(f"Error accessing workspace {ws_id}: {e}", "Debug Info")
-                    continue
+                    _dbg(f"Error removing command control: {e}", "Debug Info")
+            
+            if not removed:
+                self._remove_controls_by_scan()
             
             # Remove command definition
             try:
-                cmd_def = self.ui.commandDefinitions.itemById(CMD_ID)
+                cmd_def, _state.cmd_def = _state.cmd_def, None
+                cmd_def = cmd_def or self.ui.commandDefinitions.itemById(CMD_ID)
                 if cmd_def:
                     cmd_def.deleteMe()
-                    if DEBUG:
-                        self.ui.messageBox("Removed command definition", "Debug Info")
+                    _dbg("Removed command definition", "Debug Info")
             except Exception as e:
-                if DEBUG:
-                    self.ui.messageBox(f"Error removing command definition: {e}", "Debug Info")
+                _dbg(f"Error removing command definition: {e}", "Debug Info")
             
             # Remove palette
             try:
-                pal = self.ui.palettes.itemById(PALETTE_ID)
+                pal, _PALETTE = _PALETTE, None
+                pal = pal or self.ui.palettes.itemById(PALETTE_ID)
                 if pal:
                     pal.deleteMe()
-                    if DEBUG:
-                        self.ui.messageBox("Removed palette", "Debug Info")
+                    _dbg("Removed palette", "Debug Info")
             except Exception as e:
-                if DEBUG:
-                    self.ui.messageBox(f"Error removing palette: {e}", "Debug Info")
+                _dbg(f"Error removing palette: {e}", "Debug Info")
                 
         except Exception as e:
             if self.ui:
-                self.ui.messageBox(f'Add-In cleanup failed:\n{traceback.format_exc()}')
+                self.ui.messageBox(f'Add-In cleanup failed:\n{_fmt_exc(e)}')
 
 # ============================================================
 # Event Handlers
@@ -195,28 +287,14 @@ class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
     
     def notify(self, args: adsk.core.CommandCreatedEventArgs):
         try:
-            # Generate new session ID
-            _state.session_id = str(uuid.uuid4())
-            
-            # Create or get palette
-            ui = adsk.core.Application.get().userInterface
-            pal = ui.palettes.itemById(PALETTE_ID)
-            if not pal:
-                pal = ui.palettes.add(
-                    PALETTE_ID, 'PASCAL Agent', 
-                    HTML_FILE.as_uri(), True, True, True, 
-                    PALETTE_WIDTH, PALETTE_HEIGHT
-                )
-                
-                # Add HTML event handler
-                on_html = PaletteHTMLHandler()
-                pal.incomingFromHTML.add(on_html)
-                _state.handlers.append(on_html)
+            _state.last_sent_html = None
             
+            # The palette is built once in run() - opening it only shows it
+            pal = _PALETTE or _create_palette()
             pal.isVisible = True
             
-            # Send welcome message
-            send_to_html({
+            # Queue the welcome message so the palette paints before it arrives
+            _post_to_ui_thread("greet", "", {
                 "status": "need_clarification",
                 "assistant_message": "Hi! Tell me what you want to create. I'll ask questions, plan steps, and prepare actions safely."
             })
@@ -224,9 +302,30 @@ class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
         except Exception as e:
             send_to_html({
                 "status": "need_clarification",
-                "assistant_message": f"Command creation failed:\n{traceback.format_exc()}"
+                "assistant_message": f"Command creation failed:\n{_fmt_exc(e)}"
             })
 
+def _create_palette() -> adsk.core.Palette:
+    """Get or create the hidden chat palette and hook up its HTML handler"""
+    global _PALETTE
+    
+    palettes = _ui().palettes
+    pal = palettes.itemById(PALETTE_ID)
+    if not pal:
+        pal = palettes.add(
+            PALETTE_ID, 'PASCAL Agent', 
+            HTML_FILE.as_uri(), False, True, True, 
+            PALETTE_WIDTH, PALETTE_HEIGHT
+        )
+        
+        # Add HTML event handler
+        on_html = PaletteHTMLHandler()
+        pal.incomingFromHTML.add(on_html)
+        _state.handlers += (on_html,)
+    
+    _PALETTE = pal
+    return pal
+
 class PaletteHTMLHandler(adsk.core.HTMLEventHandler):
     """Handles messages from HTML palette"""
     
@@ -236,20 +335,17 @@ class PaletteHTMLHandler(adsk.core.HTMLEventHandler):
             if args.action != 'agent_event':
                 return
             
+            # A new turn may legitimately get the same reply as the last one
+            _state.last_sent_html = None
+            
             # Parse event data
-            data_json = args.data or "{}"
-            data = json.loads(data_json)
+            data = _loads(args.data or "{}")
             event = (data.get("event") or "").strip()
             user_message = (data.get("user_message") or "").strip()
             
-            # Acknowledge receipt
-            send_to_html({
-                "assistant_message": f"↘ received {event}",
-                "questions": [], "plan": [], "actions": []
-            })
-            
             # Handle different event types
             if event == 'user_message':
+                _state.last_request = user_message
                 handle_agent_event("user_message", user_message)
             elif event == 'confirm_execute':
                 handle_agent_event("confirm_execute", "OK to proceed")
@@ -262,80 +358,294 @@ class PaletteHTMLHandler(adsk.core.HTMLEventHandler):
         except Exception as e:
             send_to_html({
                 "status": "need_clarification",
-                "assistant_message": f"HTML parsing error:\n{traceback.format_exc()}"
+                "assistant_message": f"HTML parsing error:\n{_fmt_exc(e)}"
+            })
+
+class AgentReplyHandler(adsk.core.CustomEventHandler):
+    """Handles agent replies posted back to the UI thread"""
+    
+    def notify(self, args: adsk.core.CustomEventArgs):
+        try:
+            info = _loads(args.additionalInfo or "{}")
+            _handle_agent_reply(
+                info.get("event", ""),
+                info.get("user_message", ""),
+                info.get("reply") or {}
+            )
+        except Exception as e:
+            send_to_html({
+                "status": "need_clarification",
+                "assistant_message": f"Agent reply error:\n{_fmt_exc(e)}"
             })
 
 # ============================================================
 # Agent Communication
 # ============================================================
 
+# Set up subprocess for Windows once - keeps the worker console hidden
+_STARTUPINFO = None
+_CREATIONFLAGS = 0
+if os.name == 'nt':
+    _STARTUPINFO = subprocess.STARTUPINFO()
+    _STARTUPINFO.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    _CREATIONFLAGS = subprocess.CREATE_NO_WINDOW
+
 class AgentCommunicator:
-    """Handles communication with the external agent process"""
+    """Handles communication with the long-lived external agent process"""
+    
+    _lock = threading.Lock()
     
     @staticmethod
-    def call_agent(event: str, user_message: str) -> dict:
-        """Call the external agent process"""
+    def start():
+        """Launch the agent worker process"""
+        proc = subprocess.Popen(
+            [PYTHON_EXE, AGENT_SCRIPT, '--worker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            shell=False,
+            startupinfo=_STARTUPINFO, creationflags=_CREATIONFLAGS
+        )
+        
+        # Pump both pipes on background threads so reads can time out
+        # and a chatty stderr can never fill up and stall the worker
+        _state.agent_replies = queue.Queue()
+        _state.agent_stderr = collections.deque(maxlen=50)
+        threading.Thread(
+            target=AgentCommunicator._pump,
+            args=(proc.stdout, _state.agent_replies.put), daemon=True
+        ).start()
+        threading.Thread(
+            target=AgentCommunicator._pump,
+            args=(proc.stderr, _state.agent_stderr.append), daemon=True
+        ).start()
+        _state.agent_proc = proc
+        return proc
+    
+    @staticmethod
+    def stop(graceful: bool = False):
+        """Shut down the agent worker process"""
+        proc, _state.agent_proc = _state.agent_proc, None
+        if proc is None:
+            return
         try:
-            payload = {"event": event, "user_message": user_message}
-            
-            # Set up subprocess for Windows
-            startupinfo = None
-            creationflags = 0
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                creationflags |= subprocess.CREATE_NO_WINDOW
-            
-            # Call external process
-            completed = subprocess.run(
-                [PYTHON_EXE, AGENT_SCRIPT, _state.session_id, json.dumps(payload)],
-                capture_output=True, text=True, shell=False, timeout=REQUEST_TIMEOUT,
-                startupinfo=startupinfo, creationflags=creationflags
-            )
+            if graceful:
+                # Closing stdin ends the worker's read loop so it can exit cleanly
+                proc.stdin.close()
+                proc.wait(timeout=2)
+                return
+        except Exception:
+            pass
+        try:
+            proc.kill()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _pump(stream, sink):
+        """Forward lines from a pipe until EOF, then signal with None"""
+        try:
+            for line in iter(stream.readline, b''):
+                sink(line)
+        except Exception:
+            pass
+        sink(None)
+    
+    @staticmethod
+    def _ensure_worker():
+        """Return a running worker, restarting it if it has exited"""
+        proc = _state.agent_proc
+        if proc is None or proc.poll() is not None:
+            proc = AgentCommunicator.start()
+        return proc
+    
+    @staticmethod
+    def call_agent(event: str, user_message: str, payload_extra: dict = None, on_stream=None) -> dict:
+        """Send one event to the agent worker, resending with backoff if the worker died
+        
+        The whole exchange shares one REQUEST_TIMEOUT budget. The agent retries
+        its own LLM calls, so a slow reply is waited for, never re-sent.
+        """
+        try:
+            # Structured data such as execution results rides along as-is
+            request = _dumpb({
+                "session": _state.session_id,
+                "event": event,
+                "user_message": user_message,
+                "result": payload_extra,
+                "max_output_tokens": MAX_OUTPUT_TOKENS,
+                "stream": on_stream is not None
+            })
             
-            # Handle process errors
-            if completed.returncode != 0:
-                return {
-                    "status": "need_clarification",
-                    "assistant_message": f"Agent returned code {completed.returncode}.\nSTDERR:\n{(completed.stderr or '').strip()}"
-                }
+            deadline = time.monotonic() + REQUEST_TIMEOUT
             
-            # Parse response
-            output = (completed.stdout or "").strip()
-            try:
-                return json.loads(output or "{}")
-            except Exception as e:
-                return {
-                    "status": "need_clarification",
-                    "assistant_message": f"Agent JSON decode failed: {e}\nRaw:\n{output[:600]}"
-                }
+            for attempt in range(MAX_RETRIES):
+                reply, worker_died = AgentCommunicator._call_once(
+                    request, max(deadline - time.monotonic(), 1), on_stream
+                )
+                if not worker_died or attempt == MAX_RETRIES - 1:
+                    return reply
+                
+                delay = min(RETRY_SLEEP_SECONDS * (2 ** attempt) + random.uniform(0, 1), MAX_RETRY_SLEEP_SECONDS)
+                if time.monotonic() + delay >= deadline:
+                    return reply
+                time.sleep(delay)
+            
+            return reply
                 
         except Exception as e:
             return {
                 "status": "need_clarification",
                 "assistant_message": f"Agent call failed: {e}"
             }
+    
+    @staticmethod
+    def _call_once(request: bytes, timeout: float, on_stream=None) -> tuple[dict, bool]:
+        """Run a single request/reply exchange, returning the reply and whether the worker died
+        
+        Partial replies the worker streams ahead of the final one go to on_stream.
+        """
+        with AgentCommunicator._lock:
+            try:
+                proc = AgentCommunicator._ensure_worker()
+                proc.stdin.write(request + b"\n")
+                proc.stdin.flush()
+            except OSError:
+                # Broken pipe - the worker died between turns, restart once
+                AgentCommunicator.stop()
+                proc = AgentCommunicator._ensure_worker()
+                proc.stdin.write(request + b"\n")
+                proc.stdin.flush()
+            
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    output = _state.agent_replies.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    # Out of budget - resending would only repeat the same slow turn
+                    AgentCommunicator.stop()
+                    return {
+                        "status": "need_clarification",
+                        "assistant_message": f"Agent timed out after {REQUEST_TIMEOUT}s."
+                    }, False
+                
+                if output is None:
+                    break
+                
+                # Parse response straight from bytes - no separate text decode pass
+                output = output.strip()
+                try:
+                    reply = _loads(output or b"{}")
+                except Exception as e:
+                    # Restart the worker so its real reply can't answer the next call
+                    AgentCommunicator.stop()
+                    raw = output[:600].decode("utf-8", errors="replace")
+                    return {
+                        "status": "need_clarification",
+                        "assistant_message": f"Agent JSON decode failed: {e}\nRaw:\n{raw}"
+                    }, False
+                
+                if reply.get("status") != "streaming":
+                    break
+                if on_stream:
+                    on_stream(reply)
+        
+        # Handle process errors
+        if output is None:
+            # Only the tail of stderr is worth decoding for the error message
+            stderr = b"".join(_state.agent_stderr or ())[-2048:]
+            stderr = stderr.decode("utf-8", errors="replace").strip()
+            AgentCommunicator.stop()
+            return {
+                "status": "need_clarification",
+                "assistant_message": f"Agent process exited.\nSTDERR:\n{stderr}"
+            }, True
+        
+        return reply, False
 
 # ============================================================
 # Fusion Action Execution
 # ============================================================
 
+# Interned sketch ids for typical plans; longer plans fall back to formatting
+_SK_KEYS = tuple(sys.intern(f"sk_{i}") for i in range(64))
+
+# Extrude operation enums, resolved once on first use
+_OP_MAP = None
+
+def _get_operation_map() -> types.MappingProxyType:
+    """Get the read-only map of operation names to Fusion feature operations"""
+    global _OP_MAP
+    if _OP_MAP is None:
+        ops = adsk.fusion.FeatureOperations
+        _OP_MAP = types.MappingProxyType({
+            "NewBody": ops.NewBodyFeatureOperation,
+            "Cut": ops.CutFeatureOperation,
+            "Join": ops.JoinFeatureOperation
+        })
+    return _OP_MAP
+
 class FusionActionExecutor:
     """Executes Fusion 360 actions"""
     
+    # Construction plane attribute on the root component for each plane name
+    PLANE_ATTRS = types.MappingProxyType({
+        "XY": "xYConstructionPlane",
+        "YZ": "yZConstructionPlane",
+        "XZ": "xZConstructionPlane"
+    })
+    
+    # Actions that can move geometry out of view - in-plane curves on an
+    # existing sketch don't warrant a refit
+    FIT_VIEW_ACTIONS = frozenset(("create_sketch", "extrude_last_profile", "add_text"))
+    
     def __init__(self):
-        self.app = adsk.core.Application.get()
+        self.app = _app()
         self.design = adsk.fusion.Design.cast(self.app.activeProduct)
         if not self.design:
             raise RuntimeError("No active Fusion design")
         self.root = self.design.rootComponent
+        
+        # Collections and planes reused by every action in the batch
+        self._sketches = self.root.sketches
+        self._ext_feats = self.root.features.extrudeFeatures
+        self._plane_map = {
+            name: getattr(self.root, attr) for name, attr in self.PLANE_ATTRS.items()
+        }
+        self._op_map = _get_operation_map()
+        
+        # Bound once - saves the adsk.core/adsk.fusion lookups on every vertex and value
+        self._point3d = adsk.core.Point3D.create
+        self._real = adsk.core.ValueInput.createByReal
+        self._distance_extent = adsk.fusion.DistanceExtentDefinition.create
+        self._positive_dir = adsk.fusion.ExtentDirections.PositiveExtentDirection
+        
+        # Sketches whose compute is deferred until a profile or body is needed
+        self._deferred_sketches = []
+        
+        # Per-batch state, reset by execute_actions
+        self._sketch_context = {}
+        self._last_profile = None
+        self._profile_pending = False
+        
+        # Action name -> handler(params, idx) returning whether it succeeded
+        self._dispatch = {
+            "create_sketch": self._run_create_sketch,
+            "add_rectangle": self._run_add_rectangle,
+            "add_circle": self._run_add_circle,
+            "extrude_last_profile": self._run_extrude_last_profile,
+            "add_text": self._run_add_text,
+            "create_hole": self._run_create_hole
+        }
     
-    def execute_actions(self, actions: list) -> tuple[bool, str]:
-        """Execute a list of Fusion actions"""
+    def execute_actions(self, actions: Iterable[dict]) -> tuple[bool, str]:
+        """Execute Fusion actions one at a time as they are pulled from the iterable"""
         try:
-            sketch_context = {}
-            last_profile = None
-            made_geometry = False
+            # Per-batch state shared by the action handlers
+            self._sketch_context = {}
+            self._last_profile = None
+            self._profile_pending = False
+            view_needs_fit = False
+            dispatch = self._dispatch
+            fit_actions = self.FIT_VIEW_ACTIONS
             
             for idx, action in enumerate(actions):
                 action_name = action.get("action")
@@ -343,51 +653,22 @@ class FusionActionExecutor:
                 
                 send_debug_message(f"Processing action {idx}: {action_name}")
                 
-                if action_name == "create_sketch":
-                    success = self._create_sketch(params, sketch_context, idx)
-                    if success:
-                        made_geometry = True
-                        # Don't set last_profile here - wait for geometry
-                
-                elif action_name == "add_rectangle":
-                    success = self._add_rectangle(params, sketch_context)
-                    if success:
-                        made_geometry = True
-                        last_profile = self._get_last_profile(_state.last_sketch)
-                        if DEBUG:
-                            ui = adsk.core.Application.get().userInterface
-                            ui.messageBox(f"Rectangle created, profile: {last_profile is not None}", "Debug")
-                
-                elif action_name == "add_circle":
-                    success = self._add_circle(params, sketch_context)
-                    if success:
-                        made_geometry = True
-                        last_profile = self._get_last_profile(_state.last_sketch)
-                        if DEBUG:
-                            ui = adsk.core.Application.get().userInterface
-                            ui.messageBox(f"Circle created, profile: {last_profile is not None}", "Debug")
-                
-                elif action_name == "extrude_last_profile":
-                    # Try to use the tracked profile first, then fall back to finding it
-                    profile_to_extrude = last_profile or _state.last_profile
-                    success = self._extrude_profile(params, profile_to_extrude)
-                    if success:
-                        made_geometry = True
-                
-                elif action_name == "add_text":
-                    success = self._add_text(params)
-                    if success:
-                        made_geometry = True
-                
-                elif action_name == "create_hole":
-                    send_debug_message(f"About to create hole with params: {params}")
-                    success = self._create_hole(params)
-                    send_debug_message(f"Hole creation result: {success}")
-                    if success:
-                        made_geometry = True
-            
-            # Fit view if geometry was created
-            if made_geometry:
+                handler = dispatch.get(action_name)
+                if handler and handler(params, idx) and action_name in fit_actions:
+                    view_needs_fit = True
+            
+            self._flush_deferred_compute()
+            
+            # Geometry left unextruded is what a later batch's extrude means
+            if self._profile_pending:
+                self._profile_pending = False
+                try:
+                    self._get_last_profile(_state.last_sketch)
+                except:
+                    pass
+            
+            # Fit view only if a new sketch, text or body was created
+            if view_needs_fit:
                 try:
                     self.app.activeViewport.fit()
                 except:
@@ -396,27 +677,92 @@ class FusionActionExecutor:
             return True, "All actions executed successfully."
             
         except Exception as e:
-            return False, f"Execution error: {e}\n{traceback.format_exc()}"
+            return False, f"Execution error: {_fmt_exc(e)}"
+        finally:
+            # Never leave a sketch stuck in deferred compute
+            self._flush_deferred_compute()
+    
+    def _run_create_sketch(self, params: dict, idx: int) -> bool:
+        """Run a create_sketch action"""
+        # Don't set last_profile here - wait for geometry
+        return self._create_sketch(params, self._sketch_context, idx)
+    
+    def _run_add_rectangle(self, params: dict, idx: int) -> bool:
+        """Run a add_rectangle action"""
+        if not self._add_rectangle(params, self._sketch_context):
+            return False
+        self._profile_pending = True
+        # The cached profile belongs to older geometry now
+        _state.last_profile = None
+        _dbg("Rectangle created, profile resolved on extrude", "Debug")
+        return True
+    
+    def _run_add_circle(self, params: dict, idx: int) -> bool:
+        """Run a add_circle action"""
+        if not self._add_circle(params, self._sketch_context):
+            return False
+        self._profile_pending = True
+        # The cached profile belongs to older geometry now
+        _state.last_profile = None
+        _dbg("Circle created, profile resolved on extrude", "Debug")
+        return True
+    
+    def _run_extrude_last_profile(self, params: dict, idx: int) -> bool:
+        """Run a extrude_last_profile action"""
+        # Profiles only exist once the deferred sketches have computed
+        self._flush_deferred_compute()
+        if self._profile_pending:
+            self._last_profile = self._get_last_profile(_state.last_sketch)
+            self._profile_pending = False
+        
+        # Try to use the tracked profile first, then fall back to finding it
+        return self._extrude_profile(params, self._last_profile or _state.last_profile)
+    
+    def _run_add_text(self, params: dict, idx: int) -> bool:
+        """Run a add_text action"""
+        return self._add_text(params)
+    
+    def _run_create_hole(self, params: dict, idx: int) -> bool:
+        """Run a create_hole action"""
+        send_debug_message(f"About to create hole with params: {params}")
+        self._flush_deferred_compute()
+        success = self._create_hole(params)
+        send_debug_message(f"Hole creation result: {success}")
+        return success
+    
+    def _defer_compute(self, sketch):
+        """Batch edits to a sketch by deferring its compute until flushed"""
+        if sketch in self._deferred_sketches:
+            return
+        try:
+            sketch.isComputeDeferred = True
+            self._deferred_sketches.append(sketch)
+        except:
+            pass
+    
+    def _flush_deferred_compute(self):
+        """Recompute all deferred sketches in one go"""
+        sketches, self._deferred_sketches = self._deferred_sketches, []
+        for sketch in sketches:
+            try:
+                sketch.isComputeDeferred = False
+            except:
+                pass
     
     def _create_sketch(self, params: dict, context: dict, idx: int) -> bool:
         """Create a new sketch"""
-        plane_map = {
-            "XY": self.root.xYConstructionPlane,
-            "YZ": self.root.yZConstructionPlane,
-            "XZ": self.root.xZConstructionPlane
-        }
-        
-        plane = plane_map.get(params.get("plane", "XY"))
+        plane = self._plane_map.get(params.get("plane", "XY"))
         if not plane:
             return False
         
-        sketch = self.root.sketches.add(plane)
+        sketch = self._sketches.add(plane)
         try:
             sketch.isVisible = True
         except:
             pass
         
-        context[f"sk_{idx}"] = sketch
+        self._defer_compute(sketch)
+        context[_SK_KEYS[idx] if idx < len(_SK_KEYS) else f"sk_{idx}"] = sketch
         _state.last_sketch = sketch
         return True
     
@@ -426,12 +772,14 @@ class FusionActionExecutor:
         if not sketch:
             sketch = self._create_fallback_sketch()
         
-        x1, y1 = float(params["x1"]), float(params["y1"])
-        x2, y2 = float(params["x2"]), float(params["y2"])
+        self._defer_compute(sketch)
+        point3d = self._point3d
+        x1, y1 = _num(params["x1"]), _num(params["y1"])
+        x2, y2 = _num(params["x2"]), _num(params["y2"])
         
         sketch.sketchCurves.sketchLines.addTwoPointRectangle(
-            adsk.core.Point3D.create(x1, y1, 0),
-            adsk.core.Point3D.create(x2, y2, 0)
+            point3d(x1, y1, 0),
+            point3d(x2, y2, 0)
         )
         
         _state.last_sketch = sketch
@@ -443,9 +791,10 @@ class FusionActionExecutor:
         if not sketch:
             sketch = self._create_fallback_sketch()
         
-        cx, cy, r = float(params["cx"]), float(params["cy"]), float(params["r"])
+        self._defer_compute(sketch)
+        cx, cy, r = _num(params["cx"]), _num(params["cy"]), _num(params["r"])
         sketch.sketchCurves.sketchCircles.addByCenterRadius(
-            adsk.core.Point3D.create(cx, cy, 0), r
+            self._point3d(cx, cy, 0), r
         )
         
         _state.last_sketch = sketch
@@ -459,9 +808,7 @@ class FusionActionExecutor:
                 profile = self._find_recent_profile()
             
             if not profile:
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox("No profile found to extrude. Make sure you have a valid sketch with geometry.", "Extrude Error")
+                _dbg("No profile found to extrude. Make sure you have a valid sketch with geometry.", "Extrude Error")
                 return False
             
             # Get parameters
@@ -470,72 +817,52 @@ class FusionActionExecutor:
             
             # Validate distance
             if distance <= 0:
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox(f"Invalid distance: {distance}. Must be positive.", "Extrude Error")
+                _dbg(f"Invalid distance: {distance}. Must be positive.", "Extrude Error")
                 return False
             
             # Map operation string to Fusion enum
-            operation_map = {
-                "NewBody": adsk.fusion.FeatureOperations.NewBodyFeatureOperation,
-                "Cut": adsk.fusion.FeatureOperations.CutFeatureOperation,
-                "Join": adsk.fusion.FeatureOperations.JoinFeatureOperation
-            }
-            
-            op = operation_map.get(operation, adsk.fusion.FeatureOperations.NewBodyFeatureOperation)
+            op = self._op_map.get(operation, self._op_map["NewBody"])
             
             # Create extrude feature
-            ext_feats = self.root.features.extrudeFeatures
-            dval = adsk.core.ValueInput.createByReal(distance)
+            ext_feats = self._ext_feats
+            dval = self._real(distance)
             
             # Create input and set parameters
             ext_input = ext_feats.createInput(profile, op)
-            ext_input.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(dval), adsk.fusion.ExtentDirections.PositiveExtentDirection)
+            ext_input.setOneSideExtent(self._distance_extent(dval), self._positive_dir)
             
             # Add the feature
             ext_feat = ext_feats.add(ext_input)
             
             if ext_feat:
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox(f"Successfully extruded profile by {distance}cm", "Extrude Success")
+                _dbg(f"Successfully extruded profile by {distance}cm", "Extrude Success")
                 return True
             else:
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox("Failed to create extrude feature", "Extrude Error")
+                _dbg("Failed to create extrude feature", "Extrude Error")
                 return False
                 
         except Exception as e:
-            if DEBUG:
-                ui = adsk.core.Application.get().userInterface
-                ui.messageBox(f"Extrude error: {str(e)}", "Extrude Error")
+            _dbg(f"Extrude error: {str(e)}", "Extrude Error")
             return False
     
     def _add_text(self, params: dict) -> bool:
         """Add text to a sketch"""
-        plane_map = {
-            "XY": self.root.xYConstructionPlane,
-            "YZ": self.root.yZConstructionPlane,
-            "XZ": self.root.xZConstructionPlane
-        }
-        
-        plane = plane_map.get(params.get("plane", "XY"))
+        plane = self._plane_map.get(params.get("plane", "XY"))
         if not plane:
             return False
         
-        sketch = self.root.sketches.add(plane)
+        sketch = self._sketches.add(plane)
         try:
             sketch.isVisible = True
         except:
             pass
         
         text = str(params.get("text", ""))
-        height = float(params.get("height", 1.0))
-        x, y = float(params.get("x", 0)), float(params.get("y", 0))
+        height = _num(params.get("height", 1.0))
+        x, y = _num(params.get("x", 0)), _num(params.get("y", 0))
         
         text_input = sketch.sketchTexts.createInput(
-            text, height, adsk.core.Point3D.create(x, y, 0)
+            text, height, self._point3d(x, y, 0)
         )
         sketch.sketchTexts.add(text_input)
         
@@ -546,7 +873,7 @@ class FusionActionExecutor:
         """Create a hole feature using the correct Fusion 360 API"""
         try:
             # Show immediate popup to confirm hole creation is starting
-            ui = adsk.core.Application.get().userInterface
+            ui = _ui()
             ui.messageBox("HOLE CREATION STARTING!", "Hole Debug")
             
             send_debug_message("Starting hole creation...")
@@ -582,15 +909,15 @@ class FusionActionExecutor:
             # Create a construction plane at the target Z level
             planes = self.root.constructionPlanes
             plane_input = planes.createInput()
-            offset_val = adsk.core.ValueInput.createByReal(top_face_z)
-            plane_input.setByOffset(self.root.xYConstructionPlane, offset_val)
+            offset_val = self._real(top_face_z)
+            plane_input.setByOffset(self._plane_map["XY"], offset_val)
             target_plane = planes.add(plane_input)
             
             # Create a sketch on the target plane
-            sketch = self.root.sketches.add(target_plane)
+            sketch = self._sketches.add(target_plane)
             
             # Add a point at the specified position
-            center_point = sketch.sketchPoints.add(adsk.core.Point3D.create(x, y, 0))
+            center_point = sketch.sketchPoints.add(self._point3d(x, y, 0))
             
             # Create the hole feature using the correct API
             hole_feats = self.root.features.holeFeatures
@@ -604,9 +931,9 @@ class FusionActionExecutor:
             
             if hole_type == "simple":
                 # Simple hole using createSimpleInput
-                hole_input = hole_feats.createSimpleInput(adsk.core.ValueInput.createByReal(diameter))
+                hole_input = hole_feats.createSimpleInput(self._real(diameter))
                 hole_input.setPositionBySketchPoints(pt_coll)
-                hole_input.setDistanceExtent(adsk.core.ValueInput.createByReal(depth))
+                hole_input.setDistanceExtent(self._real(depth))
             
             elif hole_type == "counterbore":
                 # Counterbore hole
@@ -614,12 +941,12 @@ class FusionActionExecutor:
                 counterbore_depth = float(params.get("counterbore_depth", depth * 0.3))
                 
                 hole_input = hole_feats.createCounterboreInput(
-                    adsk.core.ValueInput.createByReal(diameter),
-                    adsk.core.ValueInput.createByReal(counterbore_diameter),
-                    adsk.core.ValueInput.createByReal(counterbore_depth)
+                    self._real(diameter),
+                    self._real(counterbore_diameter),
+                    self._real(counterbore_depth)
                 )
                 hole_input.setPositionBySketchPoints(pt_coll)
-                hole_input.setDistanceExtent(adsk.core.ValueInput.createByReal(depth))
+                hole_input.setDistanceExtent(self._real(depth))
             
             elif hole_type == "countersink":
                 # Countersink hole
@@ -627,12 +954,12 @@ class FusionActionExecutor:
                 countersink_angle = float(params.get("countersink_angle", 82.0))  # Standard 82° angle
                 
                 hole_input = hole_feats.createCountersinkInput(
-                    adsk.core.ValueInput.createByReal(diameter),
-                    adsk.core.ValueInput.createByReal(countersink_diameter),
-                    adsk.core.ValueInput.createByReal(countersink_angle)
+                    self._real(diameter),
+                    self._real(countersink_diameter),
+                    self._real(countersink_angle)
                 )
                 hole_input.setPositionBySketchPoints(pt_coll)
-                hole_input.setDistanceExtent(adsk.core.ValueInput.createByReal(depth))
+                hole_input.setDistanceExtent(self._real(depth))
             
             # Create the hole feature
             send_debug_message("Adding hole feature to design...")
@@ -695,7 +1022,7 @@ class FusionActionExecutor:
         if _state.last_sketch:
             return _state.last_sketch
         
-        sketch = self.root.sketches.add(self.root.xYConstructionPlane)
+        sketch = self._sketches.add(self._plane_map["XY"])
         try:
             sketch.isVisible = True
         except:
@@ -705,176 +1032,163 @@ class FusionActionExecutor:
     
     def _get_last_profile(self, sketch) -> adsk.fusion.Profile:
         """Get the last profile from a sketch"""
-        if sketch and sketch.profiles.count > 0:
-            profile = sketch.profiles.item(sketch.profiles.count - 1)
+        if not sketch:
+            return None
+        profiles = sketch.profiles
+        count = profiles.count
+        if count > 0:
+            profile = profiles.item(count - 1)
             _state.last_profile = profile
             return profile
         return None
     
     def _find_recent_profile(self) -> adsk.fusion.Profile:
-        """Find the most recent profile from any sketch"""
+        """Find the most recent profile, preferring the cached one"""
         try:
-            # First try the cached profile
-            if _state.last_profile:
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox("Using cached profile", "Profile Debug")
-                return _state.last_profile
-            
-            # Search through sketches in reverse order
-            sketches = self.root.sketches
-            if DEBUG:
-                ui = adsk.core.Application.get().userInterface
-                ui.messageBox(f"Searching {sketches.count} sketches for profiles", "Profile Debug")
-            
-            for i in range(sketches.count - 1, -1, -1):
-                sketch = sketches.item(i)
-                if DEBUG:
-                    ui = adsk.core.Application.get().userInterface
-                    ui.messageBox(f"Checking sketch {i}: {sketch.profiles.count} profiles", "Profile Debug")
-                
-                if sketch.profiles.count > 0:
-                    profile = sketch.profiles.item(sketch.profiles.count - 1)
-                    _state.last_profile = profile
-                    if DEBUG:
-                        ui.messageBox(f"Found profile in sketch {i}", "Profile Debug")
+            # First try the cached profile, if Fusion hasn't invalidated it
+            profile = _state.last_profile
+            try:
+                if profile and profile.isValid:
                     return profile
+            except:
+                pass
+            _state.last_profile = None
             
-            if DEBUG:
-                ui = adsk.core.Application.get().userInterface
-                ui.messageBox("No profiles found in any sketch", "Profile Debug")
-            return None
+            # Then the last sketch we drew into
+            try:
+                profile = self._get_last_profile(_state.last_sketch)
+            except:
+                profile = None
+            
+            # Last resort - only look at the newest few sketches
+            source = "last sketch"
+            if not profile:
+                sketches = self._sketches
+                count = sketches.count
+                for i in range(count - 1, max(count - PROFILE_SCAN_LIMIT, 0) - 1, -1):
+                    profile = self._get_last_profile(sketches.item(i))
+                    if profile:
+                        source = f"sketch {i}"
+                        break
+            
+            if profile:
+                _dbg(f"Found profile in {source}", "Profile Debug")
+            else:
+                _dbg("No profiles found in recent sketches", "Profile Debug")
+            return profile
             
         except Exception as e:
-            if DEBUG:
-                ui = adsk.core.Application.get().userInterface
-                ui.messageBox(f"Error finding profile: {str(e)}", "Profile Error")
+            _dbg(f"Error finding profile: {str(e)}", "Profile Error")
             return None
 
 # ============================================================
 # Main Event Handler
 # ============================================================
 
+# Default actions for simple shapes, used when even a forced agent reply had none
+_RECT_ACTIONS = (
+    {"action": "create_sketch", "params": {"plane": "XY"}},
+    {"action": "add_rectangle", "params": {"sketch_id": "sk_0", "x1": -1, "y1": -1, "x2": 1, "y2": 1}}
+)
+_CIRCLE_ACTIONS = (
+    {"action": "create_sketch", "params": {"plane": "XY"}},
+    {"action": "add_circle", "params": {"sketch_id": "sk_0", "cx": 0, "cy": 0, "r": 1}}
+)
+_SHAPE_PATTERNS = (
+    (re.compile(r"\b(?:square|rectangle)s?\b"), _RECT_ACTIONS),
+    (re.compile(r"\bcircles?\b"), _CIRCLE_ACTIONS)
+)
+
 def handle_agent_event(event: str, user_message: str):
-    """Main event handler for agent communication - runs synchronously for debugging"""
-    # For debugging, run synchronously to see what's happening
-    _handle_agent_event_async(event, user_message)
+    """Main event handler for agent communication - the agent call runs off the UI thread"""
+    _dispatch_agent_call(event, user_message, user_message)
+
+def _dispatch_agent_call(event: str, message: str, user_message: str, payload_extra: dict = None):
+    """Call the agent on a background thread and post the reply back to the UI thread"""
+    def _stream(partial: dict):
+        _post_to_ui_thread("stream", user_message, partial)
+    
+    def _worker():
+        reply = AgentCommunicator.call_agent(event, message, payload_extra, _stream)
+        _post_to_ui_thread(event, user_message, reply)
+    
+    threading.Thread(target=_worker, daemon=True).start()
+
+def _post_to_ui_thread(event: str, user_message: str, reply: dict) -> bool:
+    """Hand a reply to AgentReplyHandler on Fusion's UI thread, returning whether it was posted"""
+    info = {"event": event, "user_message": user_message, "reply": reply}
+    try:
+        return bool(_app().fireCustomEvent(AGENT_REPLY_EVENT_ID, _dumps(info)))
+    except:
+        # Add-in was stopped while the agent was busy
+        return False
+
+# Reply events that only need to reach the palette
+_DISPLAY_ONLY_EVENTS = frozenset(("stream", "greet", "execution_result"))
 
-def _handle_agent_event_async(event: str, user_message: str):
-    """Asynchronous agent event handler"""
+def _handle_agent_reply(event: str, user_message: str, reply: dict):
+    """Continue an agent event on the UI thread once its reply arrives"""
     global _state
     
     try:
-        # Get agent response
-        reply = AgentCommunicator.call_agent(event, user_message)
+        # Queued palette messages are ready to go out
+        if event == "flush_html":
+            _flush_html()
+            return
+        
+        # Streamed partial text, the deferred welcome and execution results
+        # are only shown
+        if event in _DISPLAY_ONLY_EVENTS:
+            send_to_html(reply)
+            return
+        
         send_to_html(reply)
         
-        # Cache actions if present
+        # Cache actions if present - a plan too long to run is refused whole,
+        # never cut short
         if isinstance(reply.get("actions"), list) and reply["actions"]:
-            _state.last_actions = reply["actions"]
+            if len(reply["actions"]) > MAX_PLAN_ACTIONS:
+                _state.last_actions = []
+                send_to_html({
+                    "status": "need_clarification",
+                    "assistant_message": f"This plan has {len(reply['actions'])} actions, more than the "
+                                         f"{MAX_PLAN_ACTIONS} I can run at once. Please split it into smaller requests.",
+                    "questions": [], "plan": [], "actions": [], "requires_confirmation": False
+                })
+                return
+            _state.last_actions = list(reply["actions"])
         
-        # Handle execution confirmation
+        # Handle execution confirmation - the agent has already forced
+        # action generation if its first answer had none
         if event == "confirm_execute":
             actions = reply.get("actions") or _state.last_actions or []
             
-            # Show debug messages in main thread
-            if DEBUG:
-                send_to_html({
-                    "assistant_message": f"DEBUG: About to execute {len(actions)} actions",
-                    "questions": [], "plan": [], "actions": []
-                })
-                for i, action in enumerate(actions):
-                    send_to_html({
-                        "assistant_message": f"DEBUG: Action {i}: {action.get('action')} - {action.get('params')}",
-                        "questions": [], "plan": [], "actions": []
-                    })
-            
             if not actions:
-                # Try to force action generation with a more specific prompt
-                force_payload = {
-                    "event": "force_actions", 
-                    "user_message": f"Generate executable Fusion actions for: {user_message}. Use default values: plane=XY, position=(0,0), size=2cm if not specified."
-                }
-                force_reply = AgentCommunicator.call_agent("force_actions", force_payload["user_message"])
-                
-                if isinstance(force_reply.get("actions"), list) and force_reply["actions"]:
-                    actions = force_reply["actions"]
-                    _state.last_actions = actions
+                # Simple shapes in the user's request map straight to default actions
+                actions = _default_actions(_state.last_request)
+                if not actions:
+                    # Still no actions - ask for clarification
                     send_to_html({
-                        "status": "ready_to_execute",
-                        "assistant_message": "Generated actions from your request. Executing now.",
-                        "questions": [], "plan": [], "actions": actions,
-                        "requires_confirmation": True
+                        "status": "need_clarification",
+                        "assistant_message": "I couldn't generate actions. Please be more specific about what you want to create.",
+                        "questions": [
+                            "What shape do you want to create (square, circle, rectangle)?",
+                            "What size (e.g., 2cm, 20mm)?",
+                            "Which plane (XY, YZ, XZ)?"
+                        ],
+                        "plan": [], "actions": [], "requires_confirmation": False
                     })
-                else:
-                    # Still no actions - create default actions based on user input
-                    default_actions = []
-                    user_lower = user_message.lower()
-                    
-                    if "square" in user_lower or "rectangle" in user_lower:
-                        default_actions = [
-                            {"action": "create_sketch", "params": {"plane": "XY"}},
-                            {"action": "add_rectangle", "params": {"sketch_id": "sk_0", "x1": -1, "y1": -1, "x2": 1, "y2": 1}}
-                        ]
-                    elif "circle" in user_lower:
-                        default_actions = [
-                            {"action": "create_sketch", "params": {"plane": "XY"}},
-                            {"action": "add_circle", "params": {"sketch_id": "sk_0", "cx": 0, "cy": 0, "r": 1}}
-                        ]
-                    
-                    if default_actions:
-                        actions = default_actions
-                        _state.last_actions = actions
-                        send_to_html({
-                            "status": "ready_to_execute",
-                            "assistant_message": "Using default actions based on your request. Executing now.",
-                            "questions": [], "plan": [], "actions": actions,
-                            "requires_confirmation": True
-                        })
-                    else:
-                        # Still no actions - ask for clarification
-                        send_to_html({
-                            "status": "need_clarification",
-                            "assistant_message": "I couldn't generate actions. Please be more specific about what you want to create.",
-                            "questions": [
-                                "What shape do you want to create (square, circle, rectangle)?",
-                                "What size (e.g., 2cm, 20mm)?",
-                                "Which plane (XY, YZ, XZ)?"
-                            ],
-                            "plan": [], "actions": [], "requires_confirmation": False
-                        })
-                        return
-            
-            # Execute actions
-            try:
-                # Show immediate popup to confirm execution is starting
-                ui = adsk.core.Application.get().userInterface
-                ui.messageBox(f"Starting execution of {len(actions)} actions", "Execution Start")
-                
-                executor = FusionActionExecutor()
-                success, details = executor.execute_actions(actions)
-                
-                # Show immediate popup with result
-                ui.messageBox(f"Execution completed: success={success}, details={details}", "Execution Result")
+                    return
                 
-                if DEBUG:
-                    send_to_html({
-                        "assistant_message": f"DEBUG: Execution result: success={success}, details={details}",
-                        "questions": [], "plan": [], "actions": []
-                    })
-            except Exception as e:
-                success, details = False, f"Failed to create executor: {e}"
-                ui.messageBox(f"Execution failed: {e}", "Execution Error")
-                if DEBUG:
-                    send_to_html({
-                        "assistant_message": f"DEBUG: Execution exception: {e}",
-                        "questions": [], "plan": [], "actions": []
-                    })
+                _state.last_actions = actions
+                send_to_html({
+                    "status": "ready_to_execute",
+                    "assistant_message": "Using default actions based on your request. Executing now.",
+                    "questions": [], "plan": [], "actions": actions,
+                    "requires_confirmation": True
+                })
             
-            # Report execution result
-            result_msg = json.dumps({"ok": success, "details": details})
-            final_reply = AgentCommunicator.call_agent("execution_result", result_msg)
-            send_to_html(final_reply)
+            _execute_and_report(actions)
             
     except Exception as e:
         send_to_html({
@@ -882,21 +1196,122 @@ def _handle_agent_event_async(event: str, user_message: str):
             "assistant_message": f"Agent processing error: {e}"
         })
 
+def _default_actions(user_message: str) -> list:
+    """Build default actions for simple shapes mentioned in the user's request"""
+    user_lower = user_message.lower()
+    for pattern, actions in _SHAPE_PATTERNS:
+        if pattern.search(user_lower):
+            return copy.deepcopy(list(actions))
+    return []
+
+def _execute_and_report(actions: list):
+    """Execute actions on the UI thread and report the result back to the agent"""
+    # Show debug messages in main thread
+    if DEBUG:
+        send_to_html({
+            "assistant_message": f"DEBUG: About to execute {len(actions)} actions",
+            "questions": [], "plan": [], "actions": []
+        })
+        for i, action in enumerate(actions):
+            send_to_html({
+                "assistant_message": f"DEBUG: Action {i}: {action.get('action')} - {action.get('params')}",
+                "questions": [], "plan": [], "actions": []
+            })
+    
+    # Execute actions
+    try:
+        # Show immediate popup to confirm execution is starting
+        ui = _ui()
+        ui.messageBox(f"Starting execution of {len(actions)} actions", "Execution Start")
+        
+        executor = FusionActionExecutor()
+        success, details = executor.execute_actions(actions)
+        
+        # Show immediate popup with result
+        ui.messageBox(f"Execution completed: success={success}, details={details}", "Execution Result")
+        
+        if DEBUG:
+            send_to_html({
+                "assistant_message": f"DEBUG: Execution result: success={success}, details={details}",
+                "questions": [], "plan": [], "actions": []
+            })
+    except Exception as e:
+        success, details = False, f"Failed to create executor: {e}"
+        ui.messageBox(f"Execution failed: {e}", "Execution Error")
+        if DEBUG:
+            send_to_html({
+                "assistant_message": f"DEBUG: Execution exception: {e}",
+                "questions": [], "plan": [], "actions": []
+            })
+    
+    # Report execution result
+    _dispatch_agent_call("execution_result", "", "", {"ok": success, "details": details})
+
 # ============================================================
 # Utility Functions
 # ============================================================
 
 def send_to_html(payload: dict):
-    """Send data to HTML palette"""
+    """Queue data for the HTML palette, skipping exact repeats of the previous message
+    
+    Messages queued during one UI-thread turn go out together in a single
+    sendInfoToHTML call once Fusion gets back to its event loop.
+    """
+    try:
+        if not _PALETTE:
+            return
+        
+        data = _dumps(payload)
+        if data == _state.last_sent_html:
+            return
+        _state.last_sent_html = data
+        
+        _state.pending_html.append(data)
+        if not _state.flush_pending:
+            # If the post fails, the next message tries again
+            _state.flush_pending = _post_to_ui_thread("flush_html", "", {})
+    except:
+        # Swallow errors to prevent UI crashes
+        pass
+
+def _flush_html():
+    """Send every queued palette message in one round-trip"""
+    pending, _state.pending_html = _state.pending_html, []
+    _state.flush_pending = False
     try:
-        ui = adsk.core.Application.get().userInterface
-        pal = ui.palettes.itemById(PALETTE_ID)
-        if pal:
-            pal.sendInfoToHTML('agent_reply', json.dumps(payload))
+        pal = _PALETTE
+        if not pal or not pending:
+            return
+        
+        # A lone message keeps the plain object shape, several go as an array
+        data = pending[0] if len(pending) == 1 else f"[{','.join(pending)}]"
+        pal.sendInfoToHTML('agent_reply', data)
     except:
         # Swallow errors to prevent UI crashes
         pass
 
+def _fmt_exc(e: BaseException, limit: int = 3) -> str:
+    """Format an exception with its innermost frames only, without reading source files"""
+    frames = traceback.StackSummary.extract(
+        traceback.walk_tb(e.__traceback__), limit=-limit, lookup_lines=False
+    )
+    where = "\n".join(f"  {Path(f.filename).name}:{f.lineno} in {f.name}" for f in frames)
+    return f"{type(e).__name__}: {e}\n{where}"
+
+def _num(value) -> float:
+    """Coerce a JSON number to float, skipping the call when it already is one"""
+    return value if type(value) is float else float(value)
+
+def _dbg(message: str, title: str = "Debug"):
+    """Log a debug message to Fusion's text log and the palette - never modal"""
+    if not DEBUG:
+        return
+    try:
+        _app().log(f"[PASCAL] {title}: {message}")
+    except:
+        pass
+    send_debug_message(f"{title}: {message}")
+
 def send_debug_message(message: str):
     """Send a debug message to the HTML palette"""
     if DEBUG:
@@ -913,9 +1328,7 @@ def run(context):
     """Add-in startup function"""
     try:
         # Debug output
-        if DEBUG:
-            ui = adsk.core.Application.get().userInterface
-            ui.messageBox("PASCAL Agent Add-in starting...", "Debug Info")
+        _dbg("PASCAL Agent Add-in starting...", "Debug Info")
         
         # Basic validation - only check for critical files
         critical_errors = []
@@ -925,73 +1338,53 @@ def run(context):
             critical_errors.append(f"Agent script not found: {AGENT_SCRIPT}")
         
         if critical_errors:
-            ui = adsk.core.Application.get().userInterface
+            ui = _ui()
             error_msg = "Critical errors:\n" + "\n".join(critical_errors)
             ui.messageBox(error_msg, "PASCAL Agent - Critical Errors")
             return
         
+        # One conversation per add-in lifetime, created before any UI is shown
+        _state.session_id = str(uuid.uuid4())
+        
+        # Start the agent worker up front so the first turn doesn't pay
+        # interpreter and SDK import cost; call_agent restarts it on demand
+        try:
+            AgentCommunicator.start()
+        except Exception as e:
+            _dbg(f"Could not start agent worker: {e}", "Debug Info")
+        
         # Set up UI - simplified version
         try:
-            app = adsk.core.Application.get()
-            ui = app.userInterface
+            app = _app()
             
-            # Create command definition
-            cmd_def = ui.commandDefinitions.itemById(CMD_ID)
-            if not cmd_def:
-                cmd_def = ui.commandDefinitions.addButtonDefinition(
-                    CMD_ID, CMD_NAME, CMD_DESC
-                )
+            # Agent replies arrive on a worker thread and are posted back here
+            _state.agent_reply_event = app.registerCustomEvent(AGENT_REPLY_EVENT_ID)
+            on_reply = AgentReplyHandler()
+            _state.agent_reply_event.add(on_reply)
+            _state.handlers += (on_reply,)
             
-            # Add command created handler
-            on_created = CommandCreatedHandler()
-            cmd_def.commandCreated.add(on_created)
-            _state.handlers.append(on_created)
+            # Command definition, its handler and toolbar placement
+            FusionUI().setup_command()
             
-            # Try to add to any available panel
+            # Build the palette now so opening the command doesn't wait on
+            # the embedded browser spinning up
             try:
-                # Try multiple workspaces
-                workspaces_to_try = ['FusionDesignEnvironment', 'FusionSolidEnvironment', 'FusionModelEnvironment']
-                ws = None
-                for ws_id in workspaces_to_try:
-                    ws = ui.workspaces.itemById(ws_id)
-                    if ws:
-                        if DEBUG:
-                            ui.messageBox(f"Found workspace: {ws_id}", "Debug Info")
-                        break
-                
-                if ws:
-                    # Try multiple panels
-                    panels_to_try = ['SolidCreatePanel', 'SolidModifyPanel', 'SolidInspectPanel']
-                    for panel_name in panels_to_try:
-                        try:
-                            panel = ws.toolbarPanels.itemById(panel_name)
-                            if panel:
-                                panel.controls.addCommand(cmd_def)
-                                if DEBUG:
-                                    ui.messageBox(f"Successfully added to {panel_name}", "Debug Info")
-                                break
-                        except:
-                            continue
-                else:
-                    if DEBUG:
-                        ui.messageBox("No workspaces found", "Debug Info")
+                _create_palette()
             except Exception as e:
-                if DEBUG:
-                    ui.messageBox(f"Error adding to panel: {e}", "Debug Info")
+                _dbg(f"Could not create palette: {e}", "Debug Info")
             
             # Debug output for successful startup
-            if DEBUG:
-                ui.messageBox("PASCAL Agent Add-in loaded successfully!", "Debug Info")
+            _dbg("PASCAL Agent Add-in loaded successfully!", "Debug Info")
                 
         except Exception as e:
-            ui = adsk.core.Application.get().userInterface
+            ui = _ui()
             ui.messageBox(f"Error setting up UI: {e}", "Debug Info")
             raise
         
     except Exception as e:
         try:
-            ui = adsk.core.Application.get().userInterface
-            ui.messageBox(f'Add-In startup failed:\n{traceback.format_exc()}')
+            ui = _ui()
+            ui.messageBox(f'Add-In startup failed:\n{_fmt_exc(e)}')
         except:
             # If we can't even show an error message, just pass
             pass
@@ -999,8 +1392,15 @@ def run(context):
 def stop(context):
     """Add-in shutdown function"""
     try:
+        AgentCommunicator.stop(graceful=True)
+        _flush_html()
+        if _state.agent_reply_event:
+            _app().unregisterCustomEvent(AGENT_REPLY_EVENT_ID)
+            _state.agent_reply_event = None
         fusion_ui = FusionUI()
         fusion_ui.cleanup_command()
+        _state.handlers = ()
+        _clear_app_cache()
     except Exception as e:
-        ui = adsk.core.Application.get().userInterface
-        ui.messageBox(f'Add-In shutdown failed:\n{traceback.format_exc()}')
+        ui = _ui()
+        ui.messageBox(f'Add-In shutdown failed:\n{_fmt_exc(e)}')
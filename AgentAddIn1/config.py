@@ -23,11 +23,18 @@ CMD_ID = 'pascal_agent_cmd'
 CMD_NAME = 'PASCAL Agent'
 CMD_DESC = 'Chat, clarify, plan, and execute CAD steps safely.'
 PALETTE_ID = 'pascal_agent_palette'
+AGENT_REPLY_EVENT_ID = 'pascal_agent_reply'
 
 # Palette dimensions
 PALETTE_WIDTH = 460
 PALETTE_HEIGHT = 600
 
+# How many of the newest sketches to search when no profile is cached
+PROFILE_SCAN_LIMIT = 5
+
+# Longest plan the add-in will execute - longer ones are refused, not truncated
+MAX_PLAN_ACTIONS = 64
+
 # ============================================================
 # External Agent Configuration
 # ============================================================
@@ -37,32 +44,31 @@ HERE = Path(__file__).resolve().parent
 EXTERNAL_DIR = HERE / 'external'
 HTML_FILE = HERE / 'palette.html'
 
-# Python environment - try multiple possible paths
-PYTHON_EXE = None
+# Python environment - prefer the bundled venv, else system Python
 AGENT_SCRIPT = str(EXTERNAL_DIR / 'agent_runner.py')
-
-# Try to find Python executable
-possible_python_paths = [
-    str(EXTERNAL_DIR / 'external_venv' / 'Scripts' / 'pythonw.exe'),
-    str(EXTERNAL_DIR / 'external_venv' / 'Scripts' / 'python.exe'),
-    'pythonw.exe',  # Fallback to system Python
-    'python.exe'    # Fallback to system Python
-]
-
-for path in possible_python_paths:
-    if Path(path).exists():
-        PYTHON_EXE = path
-        break
-
-# If no Python found, use a default
-if not PYTHON_EXE:
+VENV_SCRIPTS_DIR = EXTERNAL_DIR / 'external_venv' / 'Scripts'
+
+# One directory listing instead of a stat per candidate
+try:
+    with os.scandir(VENV_SCRIPTS_DIR) as entries:
+        _venv_scripts = {entry.name for entry in entries}
+except OSError:
+    _venv_scripts = set()
+
+if 'pythonw.exe' in _venv_scripts:
+    PYTHON_EXE = str(VENV_SCRIPTS_DIR / 'pythonw.exe')
+elif 'python.exe' in _venv_scripts:
+    PYTHON_EXE = str(VENV_SCRIPTS_DIR / 'python.exe')
+else:
     PYTHON_EXE = 'pythonw.exe'
 
 # LLM Configuration
 OPENAI_MODEL = "gpt-4o"
 MAX_RETRIES = 3
 RETRY_SLEEP_SECONDS = 0.5
+MAX_RETRY_SLEEP_SECONDS = 30.0
 REQUEST_TIMEOUT = 180
+MAX_OUTPUT_TOKENS = 1500
 
 # ============================================================
 # State Management
@@ -87,8 +93,8 @@ def validate_config():
     if not Path(AGENT_SCRIPT).exists():
         errors.append(f"Agent script not found: {AGENT_SCRIPT}")
     
-    # Non-critical warnings
-    if not Path(PYTHON_EXE).exists():
+    # Non-critical warnings - the venv was already listed at import
+    if not _venv_scripts.intersection(('pythonw.exe', 'python.exe')):
         warnings.append(f"Python executable not found: {PYTHON_EXE}")
     
     if not os.getenv("OPENAI_API_KEY"):
@@ -10,26 +10,85 @@ import pathlib
 import traceback
 import re
 import time
-from typing import List, Literal, Dict, Any, Optional
-from pydantic import BaseModel, ValidationError, ConfigDict, Field
-from openai import OpenAI
-from dotenv import load_dotenv
+import random
+import hashlib
+import sqlite3
+import functools
+import threading
+import collections
+import concurrent.futures
+from typing import List, Literal, Dict, Any, Optional, get_args
+from pydantic import BaseModel, ValidationError, ConfigDict, Field, TypeAdapter
 
-# Load environment variables
-load_dotenv()
+# orjson is optional - it parses the worker's byte lines directly and is
+# much faster at encoding replies
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumpb = orjson.dumps
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    def _dumpb(obj) -> bytes:
+        return _dumps(obj).encode("utf-8")
 
 # ============================================================
 # Configuration
 # ============================================================
 
 ROOT = pathlib.Path(__file__).resolve().parent
+
+
+def _load_env():
+    """Load KEY=VALUE pairs from the nearest .env without overriding the environment"""
+    for folder in (ROOT, *ROOT.parents):
+        env_file = folder / ".env"
+        if env_file.is_file():
+            break
+    else:
+        return
+    for line in env_file.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, _, value = line.removeprefix("export ").partition("=")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        os.environ.setdefault(key.strip(), value)
+
+
+# Load environment variables
+_load_env()
+
 STATE_DIR = ROOT / "state"
 STATE_DIR.mkdir(exist_ok=True)
+RESPONSE_CACHE_PATH = STATE_DIR / "response_cache.sqlite3"
+IDEMPOTENCY_DIR = STATE_DIR / "idempotency"
 
 # LLM Configuration
 OPENAI_MODEL = "gpt-4o"
+# Turning an approved plan into actions is mechanical reshaping
+FORCE_ACTIONS_MODEL = "gpt-4o-mini"
 MAX_TRIES = 3
 RETRY_SLEEP_S = 0.5
+MAX_RETRY_SLEEP_S = 8.0
+LLM_TIMEOUT_S = 15.0
+LLM_KEEPALIVE_S = 60.0
+MAX_OUTPUT_TOKENS = 1500
+STREAM_EMIT_CHUNKS = 50
+HISTORY_TOKEN_BUDGET = 3000
+HISTORY_MAX_TURNS = 8
+HISTORY_WINDOW_STEP = 4
+RESPONSE_CACHE_TTL_S = 3600
+RESPONSE_CACHE_MEMORY = 64
+IDEMPOTENCY_TTL_S = 60
 
 # ============================================================
 # Data Models
@@ -37,17 +96,19 @@ RETRY_SLEEP_S = 0.5
 
 StatusT = Literal["need_clarification", "planned", "ready_to_execute", "executing", "done"]
 
+ActionNameT = Literal[
+    "create_sketch",
+    "add_rectangle", 
+    "add_circle",
+    "extrude_last_profile",
+    "add_text",
+    "create_hole"
+]
+
 class Action(BaseModel):
     """Represents a single Fusion action to execute"""
     model_config = ConfigDict(extra="forbid")
-    action: Literal[
-        "create_sketch",
-        "add_rectangle", 
-        "add_circle",
-        "extrude_last_profile",
-        "add_text",
-        "create_hole"
-    ]
+    action: ActionNameT
     params: Dict[str, Any]
 
 class AgentReply(BaseModel):
@@ -60,6 +121,34 @@ class AgentReply(BaseModel):
     actions: List[Action] = Field(default_factory=list)
     requires_confirmation: bool = False
 
+# Allowed values, checked while normalizing raw LLM output
+_VALID_STATUSES = frozenset(get_args(StatusT))
+_ALLOWED_ACTIONS = frozenset(get_args(ActionNameT))
+_ACTION_KEYS = frozenset(("action", "params"))
+
+# Validators built once and reused for every turn
+_JSON_DECODER = json.JSONDecoder()
+_REPLY_ADAPTER = TypeAdapter(AgentReply)
+_ACTION_LIST = TypeAdapter(List[Action])
+
+# Structured-output format, with the schema generated once at import. Not
+# strict: strict mode needs closed objects, and action params are free-form
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "AgentReply", "schema": AgentReply.model_json_schema(), "strict": False}
+}
+
+# Returned when every LLM attempt failed, validated once at import
+_FALLBACK_REPLY = AgentReply(
+    status="need_clarification",
+    assistant_message="I had trouble processing your request. Please restate with specific details.",
+    questions=[
+        "What exact sizes (with units)?",
+        "Which plane (XY, YZ, XZ)?", 
+        "Where should it be positioned?"
+    ]
+)
+
 # ============================================================
 # Prompts and System Messages
 # ============================================================
@@ -133,48 +222,346 @@ For "20 mm sides in XY plane":
 }
 """
 
+# Every request starts with these exact messages so OpenAI's prompt cache
+# can reuse the prefix - anything that varies goes after them
+_STABLE_PREFIX = (
+    {"role": "system", "content": SYSTEM_PROMPT},
+)
+
+# Fixed turns are built once and shared; only the message-carrying ones allocate
+_CONFIRM_TURN = {"role": "user", "content": "User confirms: proceed with execution"}
+_FORCE_ACTIONS_TURN = {
+    "role": "user",
+    "content": "Convert the plan into actions now. Return JSON with status='ready_to_execute'"
+}
+# Plan approval instructions always go last, after history and the event turn
+_PLAN_APPROVED_TURN = {"role": "user", "content": "User approves the plan. Convert to actions now."}
+_FORCE_DEFAULTS_TURN = {
+    "role": "user",
+    "content": (
+        "Convert the plan into actions now. Use defaults if needed: "
+        "plane=XY, position=(0,0), units=cm. "
+        "Return JSON with status='ready_to_execute', actions[], requires_confirmation=true."
+    )
+}
+
+# Event name -> builder for the user turn that ends the prompt
+_EVENT_TURNS = {
+    "user_message": lambda message: {"role": "user", "content": message},
+    "confirm_execute": lambda message: _CONFIRM_TURN,
+    "execution_result": lambda message: {"role": "user", "content": f"Execution result: {message}"},
+    "force_actions": lambda message: _FORCE_ACTIONS_TURN
+}
+
+# Appended to planned replies that already carry actions
+CONFIRM_QUESTION = "Are you happy with this plan? Reply 'yes' to proceed to execution."
+_CONFIRM_QUESTION_KEY = CONFIRM_QUESTION.lower()
+
+# Sent after the turn on a retry, never ahead of it, to keep the prefix intact
+_RETRY_NOTE = {
+    "role": "user",
+    "content": "Your previous response was invalid. Return ONLY a valid JSON object."
+}
+
 # ============================================================
 # State Management
 # ============================================================
 
+def _approx_tokens(text: str) -> int:
+    """Rough token count - about four characters per token"""
+    return len(text) // 4
+
+# A reply is compacted once and the same string reused on every later turn,
+# so older history stays byte-identical and inside the cached prompt prefix
+@functools.lru_cache(maxsize=HISTORY_MAX_TURNS)
+def _compact_reply(content: str) -> str:
+    """Cut a stored AgentReply down to its status and message"""
+    try:
+        reply = _loads(content)
+    except ValueError:
+        return content
+    if not isinstance(reply, dict):
+        return content
+    return _dumps({
+        "status": reply.get("status"),
+        "assistant_message": reply.get("assistant_message", "")
+    })
+
+
 class StateManager:
-    """Manages conversation state and persistence"""
+    """Manages conversation state, kept in memory and appended to a JSONL log
+    
+    Each line of the log is either a turn ({"role", "content"}) or a state
+    update such as {"last_status": ...}; replaying the lines rebuilds the state.
+    """
     
     def __init__(self, session_id: str):
         self.session_id = session_id
-        self.state_path = STATE_DIR / f"{session_id}.json"
+        self.state_path = STATE_DIR / f"{session_id}.jsonl"
+        
+        # Guards the pending lines shared with the writer thread
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flushing = False
+        
+        # Only the newest turns are ever sent to the model
+        self.turn_count = 0
+        self._state = self._read()
+    
+    def _read(self) -> dict:
+        """Rebuild conversation state by replaying the log"""
+        state = {"session_id": self.session_id, "history": collections.deque(maxlen=HISTORY_MAX_TURNS)}
+        try:
+            with open(self.state_path, "rb") as f:
+                records = []
+                for line in f:
+                    try:
+                        records.append(_loads(line))
+                    except ValueError:
+                        # A torn final line from an interrupted write
+                        continue
+        except FileNotFoundError:
+            records = self._read_legacy()
+        
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            if "role" in record:
+                state["history"].append(record)
+                self.turn_count += 1
+            else:
+                state.update(record)
+        return state
+    
+    def _read_legacy(self) -> List[dict]:
+        """Convert a whole-file JSON state from older versions into log records"""
+        legacy_path = self.state_path.with_suffix(".json")
+        try:
+            data = _loads(legacy_path.read_bytes())
+        except (OSError, ValueError):
+            return []
+        if not isinstance(data, dict):
+            return []
+        
+        history = data.pop("history", None) or []
+        data.pop("session_id", None)
+        records = [data, *history] if data else list(history)
+        for record in records:
+            self._append(record)
+        return records
     
     def load(self) -> dict:
-        """Load conversation state from file"""
-        if self.state_path.exists():
+        """Get the live conversation state"""
+        return self._state
+    
+    def record_exchange(self, user_message: str, reply_json: str, **fields):
+        """Set state fields and add a user/assistant turn pair in one write"""
+        turns = ({"role": "user", "content": user_message},
+                 {"role": "assistant", "content": reply_json})
+        self._state.update(fields)
+        self._state["history"].extend(turns)
+        self.turn_count += 2
+        self._append(fields, *turns)
+    
+    def get_recent_history(self, max_turns: int = HISTORY_MAX_TURNS,
+                           token_budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+        """Get the newest turns that fit the token budget, oldest first
+        
+        Only the latest assistant reply keeps its full structure; earlier ones
+        are cut down to their status and message. The window's first turn moves
+        in steps of HISTORY_WINDOW_STEP rather than every turn, so consecutive
+        requests share the same history prefix for OpenAI's prompt cache.
+        """
+        history = self._state["history"]
+        step = HISTORY_WINDOW_STEP
+        # Index of the oldest turn to send, rounded up to a whole step
+        start = max(0, -(-(self.turn_count - max_turns) // step) * step)
+        skip = max(0, start - (self.turn_count - len(history)))
+        
+        recent = []
+        used = 0
+        seen_reply = False
+        
+        for turn in reversed(list(history)[skip:]):
+            if len(recent) >= max_turns:
+                break
+            content = turn.get("content", "")
+            if turn.get("role") == "assistant":
+                if seen_reply:
+                    content = _compact_reply(content)
+                    turn = {"role": "assistant", "content": content}
+                seen_reply = True
+            
+            used += _approx_tokens(content)
+            if recent and used > token_budget:
+                break
+            recent.append(turn)
+        
+        recent.reverse()
+        if len(recent) < self.turn_count:
+            recent.insert(0, {"role": "system", "content": "(earlier conversation omitted)"})
+        return recent
+    
+    def _append(self, *records: dict):
+        """Queue log lines and write them on a background thread"""
+        lines = [_dumpb(record) + b"\n" for record in records]
+        with self._lock:
+            self._pending.extend(lines)
+            if self._flushing:
+                return
+            self._flushing = True
+        # Not a daemon, so a one-shot run still finishes its write before exiting
+        threading.Thread(target=self._flush, daemon=False).start()
+    
+    def _flush(self):
+        """Append queued lines until none remain"""
+        while True:
+            with self._lock:
+                lines, self._pending = self._pending, []
+                if not lines:
+                    self._flushing = False
+                    return
             try:
-                return json.loads(self.state_path.read_text(encoding="utf-8"))
+                with open(self.state_path, "ab") as f:
+                    f.write(b"".join(lines))
             except Exception:
                 pass
-        return {"session_id": self.session_id, "history": []}
+
+def _normalize_message(text: str) -> str:
+    """Fold case, whitespace and trailing punctuation so near-identical prompts match"""
+    return " ".join(text.lower().split()).rstrip(".!?")
+
+
+class ResponseCache:
+    """Remembers recent planned replies so repeated prompts skip the LLM call"""
     
-    def save(self, data: dict):
-        """Save conversation state to file"""
-        self.state_path.write_text(
-            json.dumps(data, ensure_ascii=False, indent=2), 
-            encoding="utf-8"
-        )
+    def __init__(self, path: pathlib.Path = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL_S):
+        self.ttl = ttl
+        # Recent hits stay in memory so a worker answers repeats without sqlite or parsing
+        self._memory = collections.OrderedDict()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS replies (key TEXT PRIMARY KEY, created REAL, reply TEXT)"
+            )
+    
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Hash the parts that decide the reply into a cache key"""
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
     
-    def add_turn(self, role: str, content: str):
-        """Add a conversation turn to history"""
-        state = self.load()
-        state["history"].append({"role": role, "content": content})
-        self.save(state)
+    def get(self, key: str) -> Optional[AgentReply]:
+        """Get a cached reply that hasn't expired yet"""
+        cutoff = time.time() - self.ttl
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] > cutoff:
+            self._memory.move_to_end(key)
+            # Callers adjust the reply they get, so hand out a copy
+            return entry[1].model_copy(deep=True)
+        
+        try:
+            row = self._db.execute(
+                "SELECT created, reply FROM replies WHERE key = ? AND created > ?",
+                (key, cutoff)
+            ).fetchone()
+            if not row:
+                return None
+            reply = _REPLY_ADAPTER.validate_json(row[1])
+        except (sqlite3.Error, ValidationError):
+            return None
+        self._remember(key, row[0], reply)
+        return reply.model_copy(deep=True)
     
-    def get_recent_history(self, max_turns: int = 8) -> List[dict]:
-        """Get recent conversation history"""
-        state = self.load()
-        return state.get("history", [])[-max_turns:]
+    def _remember(self, key: str, created: float, reply: AgentReply):
+        """Keep a reply in the in-memory layer, evicting the least recently used"""
+        self._memory[key] = (created, reply)
+        self._memory.move_to_end(key)
+        if len(self._memory) > RESPONSE_CACHE_MEMORY:
+            self._memory.popitem(last=False)
+    
+    def set(self, key: str, reply: AgentReply):
+        """Store a reply, dropping expired entries on the way"""
+        now = time.time()
+        self._remember(key, now, reply.model_copy(deep=True))
+        try:
+            with self._db:
+                self._db.execute("DELETE FROM replies WHERE created <= ?", (now - self.ttl,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO replies VALUES (?, ?, ?)",
+                    (key, now, reply.model_dump_json())
+                )
+        except sqlite3.Error:
+            pass
 
 # ============================================================
 # LLM Communication
 # ============================================================
 
+@functools.lru_cache(maxsize=1)
+def _openai_client(api_key: str):
+    """Import the OpenAI SDK on first use so startup stays cheap"""
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    
+    # Keep connections warm between turns so the worker skips TCP/TLS setup
+    http_client = DefaultHttpxClient(
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=LLM_KEEPALIVE_S)
+    )
+    # Retries are handled by call_with_retries so each attempt stays bounded
+    return OpenAI(api_key=api_key, timeout=LLM_TIMEOUT_S, max_retries=0, http_client=http_client)
+
+
+_PARTIAL_MESSAGE_RE = re.compile(r'"assistant_message"\s*:\s*"((?:[^"\\]|\\.)*)')
+_DANGLING_ESCAPE_RE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE | re.DOTALL)
+_NEWLINE_RE = re.compile(r"[\r\n]+")
+
+def _partial_message(text: str) -> str:
+    """Pull the assistant_message written so far out of an incomplete JSON reply"""
+    match = _PARTIAL_MESSAGE_RE.search(text)
+    if not match:
+        return ""
+    # A \uXXXX escape may have been cut off mid-sequence
+    raw = _DANGLING_ESCAPE_RE.sub("", match.group(1))
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return ""
+
+
+class _ObjectScanner:
+    """Tracks brace depth across streamed text to spot where the top-level object ends"""
+    
+    __slots__ = ("depth", "in_string", "escaped")
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, text: str) -> bool:
+        """Consume more text, returning True once the outermost object has closed"""
+        depth, in_string, escaped = self.depth, self.in_string, self.escaped
+        for ch in text:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth:
+                depth -= 1
+                if not depth:
+                    return True
+        self.depth, self.in_string, self.escaped = depth, in_string, escaped
+        return False
+
+
 class LLMClient:
     """Handles communication with OpenAI API"""
     
@@ -182,13 +569,11 @@ class LLMClient:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY environment variable is not set")
-        self.client = OpenAI(api_key=api_key)
+        self.client = _openai_client(api_key)
     
     def _build_messages(self, history: List[dict], event: str, user_message: str) -> List[dict]:
         """Build message list for OpenAI API"""
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ]
+        messages = list(_STABLE_PREFIX)
         
         # Add conversation history
         for turn in history:
@@ -196,151 +581,263 @@ class LLMClient:
                 messages.append(turn)
         
         # Add current event
-        if event == "user_message":
-            messages.append({"role": "user", "content": user_message})
-        elif event == "confirm_execute":
-            messages.append({"role": "user", "content": "User confirms: proceed with execution"})
-        elif event == "execution_result":
-            messages.append({"role": "user", "content": f"Execution result: {user_message}"})
-        elif event == "force_actions":
-            messages.append({
-                "role": "user", 
-                "content": "Convert the plan into actions now. Return JSON with status='ready_to_execute'"
-            })
+        build_turn = _EVENT_TURNS.get(event)
+        if build_turn:
+            messages.append(build_turn(user_message))
         
         return messages
     
     def _parse_and_validate_response(self, content: str) -> AgentReply:
         """Parse and validate LLM response"""
         # Extract JSON from response
-        json_text = self._extract_json(content)
-        
         try:
-            parsed = json.loads(json_text)
-        except json.JSONDecodeError as e:
+            parsed = self._extract_json(content)
+        except ValueError as e:
             raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(parsed, dict):
+            raise ValueError("Invalid JSON: expected an object")
         
         # Normalize and validate
         parsed = self._normalize_response(parsed)
         
+        # Normalized output of exactly the right shape skips the schema walk
+        if self._is_well_formed(parsed):
+            return AgentReply.model_construct(**{
+                **parsed, "actions": [Action.model_construct(**action) for action in parsed["actions"]]
+            })
+        
         try:
-            return AgentReply.model_validate(parsed)
+            return _REPLY_ADAPTER.validate_python(parsed)
         except ValidationError as e:
             raise ValueError(f"Validation error: {e}")
     
-    def _extract_json(self, text: str) -> str:
-        """Extract JSON object from text"""
+    def _extract_json(self, text: str) -> Any:
+        """Parse the JSON object in a reply, tolerating code fences and surrounding text"""
+        # JSON mode normally returns a bare object - parse it in one go
+        try:
+            return _loads(text)
+        except ValueError:
+            pass
+        
         # Remove code fences
-        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), 
-                     flags=re.IGNORECASE|re.DOTALL)
+        text = _CODE_FENCE_RE.sub("", text.strip())
         
-        # Find first balanced {...} block
+        # Decode the first {...} block and ignore whatever trails it
         start = text.find('{')
-        if start == -1:
-            return text
-        
-        depth = 0
-        for i in range(start, len(text)):
-            if text[i] == '{':
-                depth += 1
-            elif text[i] == '}':
-                depth -= 1
-                if depth == 0:
-                    return text[start:i+1]
-        
-        return text
+        return _JSON_DECODER.raw_decode(text, max(start, 0))[0]
     
     def _normalize_response(self, data: dict) -> dict:
-        """Normalize response data for validation"""
-        normalized = {
-            "status": data.get("status", "need_clarification"),
+        """Normalize response data for validation in a single pass over its keys"""
+        status = data.get("status")
+        actions = data.get("actions")
+        
+        return {
+            "status": status if status in _VALID_STATUSES else "need_clarification",
             "assistant_message": data.get("assistant_message", ""),
             "questions": self._normalize_list(data.get("questions")),
             "plan": self._normalize_list(data.get("plan")),
-            "actions": self._normalize_actions(data.get("actions")),
+            # Unknown actions are dropped here rather than failing the whole reply
+            "actions": [
+                action for action in actions
+                if isinstance(action, dict) and action.get("action") in _ALLOWED_ACTIONS
+            ] if isinstance(actions, list) else [],
             "requires_confirmation": bool(data.get("requires_confirmation", False))
         }
+    
+    def _is_well_formed(self, normalized: dict) -> bool:
+        """Whether a normalized reply already matches AgentReply field for field
         
-        # Validate status
-        valid_statuses = {"need_clarification", "planned", "ready_to_execute", "executing", "done"}
-        if normalized["status"] not in valid_statuses:
-            normalized["status"] = "need_clarification"
-        
-        return normalized
+        Status, lists, flag and action names are guaranteed by _normalize_response;
+        only the message type and each action's keys and params remain to check.
+        """
+        return isinstance(normalized["assistant_message"], str) and all(
+            action.keys() == _ACTION_KEYS and isinstance(action["params"], dict)
+            for action in normalized["actions"]
+        )
     
     def _normalize_list(self, value) -> List[str]:
         """Normalize list fields"""
         if isinstance(value, str):
-            return [s.strip() for s in re.split(r"[\r\n]+", value) if s.strip()]
+            return [s.strip() for s in _NEWLINE_RE.split(value) if s.strip()]
         elif isinstance(value, list):
             return [str(item).strip() for item in value if item]
         return []
     
-    def _normalize_actions(self, value) -> List[dict]:
-        """Normalize actions field"""
-        if isinstance(value, list):
-            return [action for action in value if isinstance(action, dict) and "action" in action]
-        return []
+    def _stream_content(self, request: dict, on_progress=None,
+                        cancel: Optional[threading.Event] = None) -> str:
+        """Stream a completion, stopping as soon as the JSON object is complete
+        
+        If on_progress is given it receives the partial assistant_message
+        as soon as it starts, then every few chunks. Setting cancel abandons
+        the stream at the next chunk.
+        """
+        parts = []
+        last_partial = ""
+        scanner = _ObjectScanner()
+        
+        stream = self.client.chat.completions.create(stream=True, **request)
+        try:
+            for i, chunk in enumerate(stream, 1):
+                if cancel is not None and cancel.is_set():
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    if scanner.feed(delta):
+                        break
+                # Check every chunk until the message shows up - it comes near the
+                # start of the object, so the first words reach the UI right away
+                if on_progress and (not last_partial or i % STREAM_EMIT_CHUNKS == 0):
+                    partial = _partial_message("".join(parts))
+                    if partial and partial != last_partial:
+                        last_partial = partial
+                        on_progress(partial)
+        finally:
+            # Closing early stops generation of anything after the object
+            stream.close()
+        
+        return "".join(parts)
     
-    def call_with_retries(self, messages: List[dict]) -> AgentReply:
-        """Call LLM with retry logic"""
+    def call_with_retries(self, messages: List[dict], max_output_tokens: Optional[int] = None,
+                          on_progress=None, model: str = OPENAI_MODEL,
+                          cancel: Optional[threading.Event] = None) -> AgentReply:
+        """Call LLM with retry logic and exponential backoff, reporting streamed progress if asked"""
         last_error = None
         
         for attempt in range(MAX_TRIES):
+            if cancel is not None and cancel.is_set():
+                break
             try:
-                # Add correction message if retrying
-                if attempt > 0:
-                    messages.append({
-                        "role": "system",
-                        "content": "Your previous response was invalid. Return ONLY a valid JSON object."
-                    })
-                
-                response = self.client.chat.completions.create(
-                    model=OPENAI_MODEL,
+                request = dict(
+                    model=model,
                     temperature=0.2,
-                    response_format={"type": "json_object"},
-                    messages=messages
+                    response_format=_RESPONSE_FORMAT,
+                    max_tokens=max_output_tokens or MAX_OUTPUT_TOKENS,
+                    # Add correction message if retrying
+                    messages=messages if attempt == 0 else [*messages, _RETRY_NOTE]
                 )
                 
-                content = response.choices[0].message.content or ""
+                content = self._stream_content(request, on_progress, cancel)
                 return self._parse_and_validate_response(content)
                 
             except Exception as e:
                 last_error = e
                 if attempt < MAX_TRIES - 1:
-                    time.sleep(RETRY_SLEEP_S)
-        
-        # Return fallback response after all retries
-        return AgentReply(
-            status="need_clarification",
-            assistant_message="I had trouble processing your request. Please restate with specific details.",
-            questions=[
-                "What exact sizes (with units)?",
-                "Which plane (XY, YZ, XZ)?", 
-                "Where should it be positioned?"
-            ]
-        )
+                    time.sleep(min(RETRY_SLEEP_S * (2 ** attempt) + random.uniform(0, RETRY_SLEEP_S), MAX_RETRY_SLEEP_S))
+        
+        # Return fallback response after all retries - a copy, as callers may adjust it
+        return _FALLBACK_REPLY.model_copy(deep=True)
 
 # ============================================================
 # Conversation Handler
 # ============================================================
 
+# One scan per plan step finds every keyword the heuristic cares about
+_PLAN_KEYWORD_RE = re.compile(r"sketch|xy|rectangle|square|circle|extrude")
+
+# (keywords, all required, action) - the first matching rule wins
+_PLAN_STEP_RULES = (
+    (frozenset(("sketch", "xy")), True,
+     {"action": "create_sketch", "params": {"plane": "XY"}}),
+    (frozenset(("rectangle", "square")), False,
+     {"action": "add_rectangle", "params": {"sketch_id": "sk_0", "x1": -1, "y1": -1, "x2": 1, "y2": 1}}),
+    (frozenset(("circle",)), False,
+     {"action": "add_circle", "params": {"sketch_id": "sk_0", "cx": 0, "cy": 0, "r": 1}}),
+    (frozenset(("extrude",)), False,
+     {"action": "extrude_last_profile", "params": {"distance": 1, "operation": "NewBody"}})
+)
+
+# "yes..." and "ok..." count as before; a bare "y" and the other phrases
+# only on their own, so "y = 2cm" or "sure, but make it 3cm" aren't approval
+_CONFIRM_RE = re.compile(
+    r"(?:yes|ok|y$|(?:yeah|yep|sure|proceed|confirm|go ahead|looks good|sounds good|do it|alright)[\s.!]*$)"
+)
+
+# Replies are a handful of short strings ("yes", "ok", ...) seen over and over
+@functools.lru_cache(maxsize=256)
+def _is_confirmation_text(text: str) -> bool:
+    """Whether user text reads as approval"""
+    return _CONFIRM_RE.match(text.strip().lower()) is not None
+
+def _plan_step_action(step: str) -> Optional[dict]:
+    """Map a plan step to a default action by the keywords it mentions"""
+    hits = set(_PLAN_KEYWORD_RE.findall(step.lower()))
+    if not hits:
+        return None
+    for keywords, need_all, action in _PLAN_STEP_RULES:
+        if keywords <= hits if need_all else not keywords.isdisjoint(hits):
+            return action
+    return None
+
+
+# Requests simple enough to plan without the LLM - the whole message must match,
+# so anything with extra detail (position, several shapes, ...) still goes to the model
+_SIMPLE_SQUARE_RE = re.compile(
+    r"(?:make|create|draw)\s+an?\s+(\d+(?:\.\d+)?)\s*(cm|mm)\s+square\s+on\s+(?:the\s+)?(xy|yz|xz)"
+    r"(?:\s+plane)?(?:\s+and\s+extrude(?:\s+it)?(?:\s+by)?\s+(\d+(?:\.\d+)?)\s*(cm|mm))?[.!]?",
+    re.IGNORECASE
+)
+_TO_CM = {"cm": 1.0, "mm": 0.1}
+
+def _parse_locally(user_message: str) -> Optional[AgentReply]:
+    """Build the reply for a plain "make a N cm square on XY [and extrude M cm]" request"""
+    m = _SIMPLE_SQUARE_RE.fullmatch(user_message.strip())
+    if not m:
+        return None
+    size, unit, plane, depth, depth_unit = m.groups()
+    half = float(size) * _TO_CM[unit.lower()] / 2
+    distance = float(depth) * _TO_CM[depth_unit.lower()] if depth else None
+    # A zero size or depth needs a question, which is the model's job
+    if not half or distance == 0:
+        return None
+    plane = plane.upper()
+    
+    plan = [f"1. Create sketch on {plane} plane",
+            f"2. Add {half * 2:g}cm square centered at origin"]
+    actions = [
+        Action.model_construct(action="create_sketch", params={"plane": plane}),
+        Action.model_construct(action="add_rectangle", params={
+            "sketch_id": "sk_0", "x1": -half, "y1": -half, "x2": half, "y2": half
+        })
+    ]
+    if distance:
+        plan.append(f"3. Extrude the square {distance:g}cm as a new body")
+        actions.append(Action.model_construct(
+            action="extrude_last_profile", params={"distance": distance, "operation": "NewBody"}
+        ))
+    
+    return AgentReply.model_construct(
+        status="ready_to_execute",
+        assistant_message=f"I will create a {half * 2:g}cm square centered at origin on the {plane} plane"
+                          + (f" and extrude it {distance:g}cm." if distance else "."),
+        questions=[],
+        plan=plan,
+        actions=actions,
+        requires_confirmation=True
+    )
+
+
+# Runs the speculative forced-action call next to the main one
+_SPECULATIVE_CALLS = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm")
+
 class ConversationHandler:
     """Handles the conversation flow and state transitions"""
     
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, llm_client: Optional[LLMClient] = None,
+                 max_output_tokens: Optional[int] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 state_manager: Optional[StateManager] = None):
         self.session_id = session_id
-        self.state_manager = StateManager(session_id)
-        self.llm_client = LLMClient()
+        self.state_manager = state_manager or StateManager(session_id)
+        self.llm_client = llm_client or LLMClient()
+        self.max_output_tokens = max_output_tokens
+        self.response_cache = response_cache or ResponseCache()
+        # Receives the partial assistant_message while a reply streams in
+        self.on_progress = None
     
     def _is_confirmation(self, text: str) -> bool:
         """Check if user text is a confirmation"""
-        text = text.strip().lower()
-        confirmations = {
-            "yes", "y", "ok", "okay", "sure", "proceed", "confirm", 
-            "go ahead", "looks good", "sounds good", "do it"
-        }
-        return text in confirmations or text.startswith("yes") or text.startswith("ok")
+        return _is_confirmation_text(text)
     
     def _ensure_confirmation_question(self, reply: AgentReply) -> AgentReply:
         """Add confirmation question to planned responses"""
@@ -352,38 +849,54 @@ class ConversationHandler:
                 # Try to generate actions from the plan
                 if reply.plan:
                     # Simple action generation based on plan
-                    actions = []
-                    for i, step in enumerate(reply.plan):
-                        if "sketch" in step.lower() and "xy" in step.lower():
-                            actions.append({"action": "create_sketch", "params": {"plane": "XY"}})
-                        elif "rectangle" in step.lower() or "square" in step.lower():
-                            actions.append({"action": "add_rectangle", "params": {"sketch_id": "sk_0", "x1": -1, "y1": -1, "x2": 1, "y2": 1}})
-                        elif "circle" in step.lower():
-                            actions.append({"action": "add_circle", "params": {"sketch_id": "sk_0", "cx": 0, "cy": 0, "r": 1}})
-                        elif "extrude" in step.lower():
-                            actions.append({"action": "extrude_last_profile", "params": {"distance": 1, "operation": "NewBody"}})
-                    reply.actions = actions
-            else:
-                confirm_q = "Are you happy with this plan? Reply 'yes' to proceed to execution."
-                if confirm_q not in reply.questions:
-                    reply.questions.append(confirm_q)
+                    actions = [
+                        action for action in map(_plan_step_action, reply.plan) if action
+                    ]
+                    reply.actions = _ACTION_LIST.validate_python(actions)
+            # The model sometimes echoes the question back with other casing or spacing
+            elif not any(q.strip().lower() == _CONFIRM_QUESTION_KEY for q in reply.questions):
+                reply.questions.append(CONFIRM_QUESTION)
         return reply
     
     def _handle_plan_confirmation(self, user_message: str, last_status: str) -> bool:
         """Check if user is confirming a plan"""
         return (self._is_confirmation(user_message) and last_status == "planned")
     
-    def _force_action_generation(self, messages: List[dict]) -> AgentReply:
+    def _force_action_generation(self, messages: List[dict], report_progress: bool = True,
+                                 cancel: Optional[threading.Event] = None) -> AgentReply:
         """Force the LLM to generate actions from plan"""
-        messages.append({
-            "role": "user",
-            "content": (
-                "Convert the plan into actions now. Use defaults if needed: "
-                "plane=XY, position=(0,0), units=cm. "
-                "Return JSON with status='ready_to_execute', actions[], requires_confirmation=true."
-            )
-        })
-        return self.llm_client.call_with_retries(messages)
+        messages.append(_FORCE_DEFAULTS_TURN)
+        on_progress = self.on_progress if report_progress else None
+        return self.llm_client.call_with_retries(
+            messages, self.max_output_tokens, on_progress, FORCE_ACTIONS_MODEL, cancel
+        )
+    
+    def _stored_actions(self, state: dict, last_status: Optional[str]) -> List[Action]:
+        """Rebuild the actions saved with the reply being confirmed
+        
+        They were dumped from validated models, so they are constructed
+        without another validation pass.
+        """
+        if last_status != "ready_to_execute":
+            return []
+        stored = state.get("last_actions")
+        if not isinstance(stored, list) or not all(
+            isinstance(a, dict) and a.keys() == _ACTION_KEYS for a in stored
+        ):
+            return []
+        return [Action.model_construct(**a) for a in stored]
+    
+    def _cache_key(self, event: str, user_message: str, last_status: Optional[str]) -> Optional[str]:
+        """Key for a reusable reply - only typed messages are cached, and only in
+        the context of the status and reply they follow"""
+        if event != "user_message":
+            return None
+        previous = ""
+        for turn in reversed(self.state_manager.load().get("history", [])):
+            if isinstance(turn, dict) and turn.get("role") == "assistant":
+                previous = turn.get("content", "")
+                break
+        return ResponseCache.key(event, last_status or "", _normalize_message(user_message), previous)
     
     def process_event(self, event: str, user_message: str) -> AgentReply:
         """Process a conversation event and return response"""
@@ -396,19 +909,53 @@ class ConversationHandler:
         messages = self.llm_client._build_messages(history, event, user_message)
         
         # Handle plan confirmation
-        if self._handle_plan_confirmation(user_message, last_status):
-            messages.append({
-                "role": "user",
-                "content": "User approves the plan. Convert to actions now."
-            })
+        plan_confirmed = self._handle_plan_confirmation(user_message, last_status)
+        if plan_confirmed:
+            messages.append(_PLAN_APPROVED_TURN)
         
-        # Get LLM response
-        reply = self.llm_client.call_with_retries(messages)
+        # Plain requests are planned locally, a prompt just answered in the same
+        # context comes from the cache, and only the rest goes to the LLM
+        reply = _parse_locally(user_message) if event == "user_message" and not plan_confirmed else None
+        cache_key = self._cache_key(event, user_message, last_status) if reply is None else None
+        if cache_key:
+            reply = self.response_cache.get(cache_key)
+        forced_future = None
+        forced_cancel = threading.Event()
+        if reply is None:
+            # An approved plan often needs the forced pass as well - run it
+            # alongside the first call instead of after it
+            if plan_confirmed:
+                forced_future = _SPECULATIVE_CALLS.submit(
+                    self._force_action_generation, list(messages), False, forced_cancel
+                )
+            reply = self.llm_client.call_with_retries(messages, self.max_output_tokens, self.on_progress)
+            # Only plans are worth reusing - clarifications and fallbacks are cheap to redo
+            if cache_key and (reply.actions or reply.plan):
+                self.response_cache.set(cache_key, reply)
         
         # Handle plan confirmation edge cases
-        if (self._handle_plan_confirmation(user_message, last_status) and 
-            reply.status != "ready_to_execute"):
-            reply = self._force_action_generation(messages)
+        if plan_confirmed and reply.status != "ready_to_execute":
+            if forced_future:
+                reply = forced_future.result()
+            else:
+                reply = self._force_action_generation(messages)
+        elif forced_future:
+            # The first call already has the actions - stop paying for the second
+            forced_cancel.set()
+            forced_future.cancel()
+        
+        # A confirmation must come back with actions - reuse the ones just
+        # confirmed, else force them within this same request rather than
+        # making the add-in call back
+        if event == "confirm_execute" and not reply.actions:
+            stored = self._stored_actions(state, last_status)
+            if stored:
+                reply.actions = stored
+                reply.status = "ready_to_execute"
+            else:
+                forced = self._force_action_generation(messages)
+                if forced.actions:
+                    reply = forced
         
         # Add confirmation question if needed
         reply = self._ensure_confirmation_question(reply)
@@ -425,13 +972,12 @@ class ConversationHandler:
         if reply.status == "ready_to_execute":
             reply.requires_confirmation = True
         
-        # Save state
-        state["last_status"] = reply.status
-        if reply.actions:
-            state["last_actions"] = [action.model_dump() for action in reply.actions]
-        
-        self.state_manager.add_turn("user", user_message)
-        self.state_manager.add_turn("assistant", json.dumps(reply.model_dump()))
+        # Save state - dump the reply once and reuse it for the stored turn
+        data = reply.model_dump()
+        fields = {"last_status": reply.status}
+        if data["actions"]:
+            fields["last_actions"] = data["actions"]
+        self.state_manager.record_exchange(user_message, _dumps(data), **fields)
         
         return reply
 
@@ -439,49 +985,162 @@ class ConversationHandler:
 # Main Entry Point
 # ============================================================
 
+def _error_reply(message: str) -> dict:
+    """Build a clarification reply describing an agent-side failure"""
+    return {
+        "status": "need_clarification",
+        "assistant_message": message,
+        "questions": [], "plan": [], "actions": [], "requires_confirmation": False
+    }
+
+def _write_line(obj: dict):
+    """Write one JSON line to stdout as UTF-8 bytes"""
+    sys.stdout.buffer.write(_dumpb(obj) + b"\n")
+    sys.stdout.buffer.flush()
+
+def _prune_replies(directory: pathlib.Path, cutoff: float):
+    """Delete stored one-shot replies written before cutoff"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+def _stored_reply(path: pathlib.Path, turn_count: int) -> Optional[bytes]:
+    """Get a stored one-shot reply if it is fresh and no turn was added since"""
+    try:
+        if time.time() - path.stat().st_mtime >= IDEMPOTENCY_TTL_S:
+            return None
+        count, _, reply = path.read_bytes().partition(b"\n")
+    except OSError:
+        return None
+    return reply if reply and count == b"%d" % turn_count else None
+
+def _payload_message(payload: dict) -> str:
+    """Get the event text, rendering a structured execution result if one was sent"""
+    user_message = (payload.get("user_message") or "").strip()
+    result = payload.get("result")
+    if not user_message and isinstance(result, dict):
+        user_message = _dumps(result)
+    return user_message
+
+def serve():
+    """Serve newline-delimited JSON requests from the add-in until stdin closes"""
+    # Raw UTF-8 bytes in both directions; the parser handles the decoding
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    
+    # Shared across turns so the OpenAI client and its connections survive
+    llm_client = None
+    response_cache = None
+    handlers: Dict[str, ConversationHandler] = {}
+    
+    def emit(partial: str):
+        """Write a progress line ahead of the final reply"""
+        stdout.write(_dumpb({"status": "streaming", "assistant_message": partial}) + b"\n")
+        stdout.flush()
+    
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        try:
+            payload = _loads(line)
+            event = payload.get("event", "user_message")
+            user_message = _payload_message(payload)
+            
+            if llm_client is None:
+                llm_client = LLMClient()
+                response_cache = ResponseCache()
+            
+            # One handler (and StateManager) per session for the worker's lifetime
+            session_id = payload["session"]
+            handler = handlers.get(session_id)
+            if handler is None:
+                handler = handlers[session_id] = ConversationHandler(
+                    session_id, llm_client, response_cache=response_cache
+                )
+            handler.max_output_tokens = payload.get("max_output_tokens")
+            handler.on_progress = emit if payload.get("stream") else None
+            # Serialized straight from the model, without an intermediate dict
+            out = handler.process_event(event, user_message).model_dump_json().encode("utf-8")
+        except Exception as e:
+            # Include the exception type so the add-in can spot transient failures
+            out = _dumpb(_error_reply(f"Agent error: {type(e).__name__}: {e}"))
+        
+        stdout.write(out + b"\n")
+        stdout.flush()
+
 def main():
     """Main entry point for the agent runner"""
     try:
+        # Persistent worker mode used by the add-in
+        if len(sys.argv) == 2 and sys.argv[1] == "--worker":
+            serve()
+            return
+        
         # Parse command line arguments
-        if len(sys.argv) < 3:
-            print(json.dumps({"error": "Usage: agent_runner.py <session_id> <json_payload | ->"}))
+        if len(sys.argv) < 2:
+            _write_line({"error": "Usage: agent_runner.py --worker | <session_id> [json_payload | file.json | -]"})
             sys.exit(2)
         
         session_id = sys.argv[1]
-        raw_payload = sys.argv[2]
+        # Payload defaults to stdin, which avoids argv quoting and length limits
+        raw_payload = sys.argv[2] if len(sys.argv) > 2 else "-"
         
         # Parse payload
         try:
             if raw_payload == "-":
-                payload = json.loads(sys.stdin.read())
+                raw = sys.stdin.buffer.read()
             elif raw_payload.endswith(".json") and pathlib.Path(raw_payload).exists():
-                payload = json.loads(pathlib.Path(raw_payload).read_text())
+                raw = pathlib.Path(raw_payload).read_bytes()
             else:
-                payload = json.loads(raw_payload)
+                raw = raw_payload.encode("utf-8")
+            payload = _loads(raw)
         except Exception as e:
-            print(json.dumps({
-                "status": "need_clarification",
-                "assistant_message": f"Could not parse payload: {e}",
-                "questions": [], "plan": [], "actions": [], "requires_confirmation": False
-            }))
+            _write_line(_error_reply(f"Could not parse payload: {e}"))
             sys.exit(3)
         
+        # A repeat of the same request moments later (double click, caller
+        # retry) gets the reply already produced for it - checked before the
+        # LLM client exists, so a replay never pays for its setup
+        state_manager = StateManager(session_id)
+        digest = hashlib.blake2b(session_id.encode("utf-8") + b"\0" + raw, digest_size=16).hexdigest()
+        replay_path = IDEMPOTENCY_DIR / f"{digest}.replay"
+        stored = _stored_reply(replay_path, state_manager.turn_count)
+        if stored is not None:
+            sys.stdout.buffer.write(stored)
+            sys.stdout.buffer.flush()
+            return
+        
         # Process event
         event = payload.get("event", "user_message")
-        user_message = payload.get("user_message", "").strip()
+        user_message = _payload_message(payload)
         
-        handler = ConversationHandler(session_id)
+        handler = ConversationHandler(
+            session_id, max_output_tokens=payload.get("max_output_tokens"), state_manager=state_manager
+        )
         reply = handler.process_event(event, user_message)
         
-        # Output response
-        print(json.dumps(reply.model_dump(), ensure_ascii=False))
+        # Output response as raw UTF-8 bytes
+        out = reply.model_dump_json().encode("utf-8") + b"\n"
+        sys.stdout.buffer.write(out)
+        sys.stdout.buffer.flush()
+        
+        # Stored with the turn count it left behind, so the same text sent
+        # again after the conversation moved on (another "yes" for a new
+        # plan) is processed as a new turn
+        try:
+            IDEMPOTENCY_DIR.mkdir(exist_ok=True)
+            _prune_replies(IDEMPOTENCY_DIR, time.time() - IDEMPOTENCY_TTL_S)
+            replay_path.write_bytes(b"%d\n" % state_manager.turn_count + out)
+        except OSError:
+            pass
         
     except Exception as e:
-        print(json.dumps({
-            "status": "need_clarification",
-            "assistant_message": f"Agent error: {e}",
-            "questions": [], "plan": [], "actions": [], "requires_confirmation": False
-        }))
+        _write_line(_error_reply(f"Agent error: {e}"))
 
 if __name__ == "__main__":
     main()
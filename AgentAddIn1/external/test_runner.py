@@ -108,6 +108,10 @@ payload = {
 
 # ------------------ Helpers ------------------
 
+# Fallback clarifications, used when the model leaves questions[] empty
+SIZE_QUESTION = "Should 2 cm refer to side length (2×2 cm) or 2 cm² area?"
+POSITION_QUESTION = "Where should the shape be positioned on the XY plane (e.g., centered at origin or specific coordinates)?"
+
 def coerce_defaults(d: dict) -> dict:
     d = dict(d)
     d.setdefault("assistant_message", "")
@@ -134,16 +138,24 @@ def postprocess_reply(reply: AgentReply, user_text: str) -> AgentReply:
             # Heuristics for common geometry clarifications
             t = user_text.lower()
             if "square" in t and "cm" in t:
-                qs.append("Should 2 cm refer to side length (2×2 cm) or 2 cm² area?")
-            qs.append("Where should the shape be positioned on the XY plane (e.g., centered at origin or specific coordinates)?")
+                qs.append(SIZE_QUESTION)
+            qs.append(POSITION_QUESTION)
         reply.questions = qs
     return reply
 
+_CLIENT = None  # built on first call, then reused with its connection pool
+
+def get_client() -> OpenAI:
+    global _CLIENT
+    if _CLIENT is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
+        _CLIENT = OpenAI(api_key=api_key)
+    return _CLIENT
+
 def call_model(messages) -> AgentReply:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
-    client = OpenAI(api_key=api_key)
+    client = get_client()
 
     resp = client.chat.completions.create(
         model="gpt-4o-mini",           # use a chat-completions model available to your account
@@ -153,6 +165,13 @@ def call_model(messages) -> AgentReply:
     )
     content = resp.choices[0].message.content  # JSON string
 
+    # Parse + validate in one pass; missing keys fall back to the field defaults
+    try:
+        return AgentReply.model_validate_json(content)
+    except ValidationError:
+        pass
+
+    # Schema mismatch - reparse so the error report can show the raw JSON
     try:
         raw = json.loads(content)
     except Exception as e:
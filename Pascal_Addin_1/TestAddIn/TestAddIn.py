@@ -1,5 +1,6 @@
 # TextRunner.py
-import adsk.core, adsk.fusion, adsk.cam, traceback, subprocess
+import adsk.core, adsk.fusion, adsk.cam, traceback, subprocess, json
+import threading, queue, collections
 
 # === EDIT THESE TWO PATHS ===
 PYTHON_EXE     = r"D:\Desktop\Pascal_Addins\TestAddIn\venv\Scripts\python.exe"
@@ -14,7 +15,66 @@ CMD_ID          = 'text_runner_cmd'
 CMD_NAME        = 'PASCAL AI'
 CMD_DESCRIPTION = 'Pass text to an external Python and run it.'
 
+WORKER_TIMEOUT = 30  # seconds to wait for one reply before giving up
+
 _handlers = []  # prevent GC of event handlers
+_proc = None    # long-lived external Python, reused across clicks
+_replies = None # stdout lines of the worker, filled by a reader thread
+_stderr = None  # last stderr lines of the worker, for error messages
+_stderr_reader = None
+
+
+def _pump(stream, sink):
+    """Forward lines from a pipe until EOF, then signal with None"""
+    try:
+        for line in iter(stream.readline, ''):
+            sink(line)
+    except Exception:
+        pass
+    sink(None)
+
+
+def _worker():
+    """Return the running external worker, starting it if needed"""
+    global _proc, _replies, _stderr, _stderr_reader
+    if _proc is None or _proc.poll() is not None:
+        _proc = subprocess.Popen(
+            [PYTHON_EXE, EXTERNAL_SCRIPT, '--server'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            shell=False
+        )
+        # Read both pipes on threads so a reply can time out and stderr never fills up
+        _replies = queue.Queue()
+        _stderr = collections.deque(maxlen=50)
+        threading.Thread(target=_pump, args=(_proc.stdout, _replies.put), daemon=True).start()
+        _stderr_reader = threading.Thread(target=_pump, args=(_proc.stderr, _stderr.append), daemon=True)
+        _stderr_reader.start()
+    return _proc
+
+
+def _stop_worker():
+    """Close the worker's stdin so it exits, killing it if it hangs"""
+    global _proc
+    proc, _proc = _proc, None
+    if proc is None:
+        return
+    try:
+        proc.stdin.close()
+        proc.wait(timeout=2)
+    except Exception:
+        proc.kill()
+    # Let the reader collect whatever the worker printed on its way out
+    if _stderr_reader:
+        _stderr_reader.join(timeout=1)
+
+
+def _stderr_tail():
+    """Last lines the worker wrote to stderr"""
+    return ''.join(line for line in (_stderr or ()) if line)[-2000:].strip()
 
 
 def run(context):
@@ -45,6 +105,9 @@ def run(context):
         else:
             ui.messageBox(f"Toolbar panel '{PANEL_ID}' not found.")
 
+        # Pay interpreter startup once, not on every click
+        _worker()
+
     except:
         if ui:
             ui.messageBox('Add-In start failed:\n{}'.format(traceback.format_exc()))
@@ -53,6 +116,8 @@ def run(context):
 def stop(context):
     ui = None
     try:
+        _stop_worker()
+
         app = adsk.core.Application.get()
         ui  = app.userInterface
 
@@ -105,20 +170,34 @@ class _CommandExecuteHandler(adsk.core.CommandEventHandler):
             inputs = args.firingEvent.sender.commandInputs
             text_in = inputs.itemById('userText').value if inputs.itemById('userText') else ''
 
-            # === Run your external Python ===
-            completed = subprocess.run(
-                [PYTHON_EXE, EXTERNAL_SCRIPT, text_in],
-                capture_output=True,
-                text=True,
-                shell=False
-            )
-
-            out = (completed.stdout or '').strip()
-            err = (completed.stderr or '').strip()
+            # === Send the text to the external Python (one JSON line each way) ===
+            proc = _worker()
+            try:
+                proc.stdin.write(json.dumps({'text': text_in}) + '\n')
+                proc.stdin.flush()
+                line = _replies.get(timeout=WORKER_TIMEOUT)
+                problem = 'exited without a reply'
+            except queue.Empty:
+                line = None
+                problem = f'did not reply within {WORKER_TIMEOUT}s'
+            except OSError:
+                line = None
+                problem = 'exited without a reply'
+            if not line:
+                # Worker died or hung - the next click starts a fresh one
+                _stop_worker()
+                ui.messageBox(
+                    f"External worker {problem}.\n\nSTDERR:\n{_stderr_tail() or '(none)'}"
+                )
+                return
+
+            reply = json.loads(line)
+            out = (reply.get('output') or '').strip()
+            err = (reply.get('error') or '').strip()
 
             # Show what the external script returned
             ui.messageBox(
-                f"External finished (code {completed.returncode}).\n\nSTDOUT:\n{out}\n\nSTDERR:\n{err or '(none)'}"
+                f"External finished.\n\nOUTPUT:\n{out}\n\nERROR:\n{err or '(none)'}"
             )
 
             # === Make a visible change in the model using the result ===
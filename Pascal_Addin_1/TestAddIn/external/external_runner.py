@@ -1,6 +1,26 @@
-import sys 
+import sys, json
+
+
+def process(text):
+    return f"Processed: {text.strip().upper()}"
+
+
+def serve():
+    # One JSON request per line in, one JSON reply per line out
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            reply = {"output": process(json.loads(line).get("text", ""))}
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
 
 if __name__ == "__main__":
-    text = sys.argv[1] if len(sys.argv) > 1 else ""
-    processed = f"Processed: {text.strip().upper()}"
-    print(processed)
\ No newline at end of file
+    if sys.argv[1:] == ["--server"]:
+        serve()
+    else:
+        text = sys.argv[1] if len(sys.argv) > 1 else ""
+        print(process(text))